@@ -1,4 +1,5 @@
 import os
+import sys
 import numpy as np
 import xarray as xr
 import glob
@@ -6,6 +7,10 @@ from tqdm import tqdm
 import matplotlib.pyplot as plt
 import pandas as pd
 
+#import own methods (from the root of the repository)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from readers.daily_nc import open_daily_dataset
+
 # Define the base directory for the NetCDF files
 base_dir = "/data/sat/msg/netcdf/parallax"
 
@@ -60,8 +65,8 @@ def process_hour(hour, years, months):
 
             for nc_file in tqdm(nc_files, desc=f"Processing {year}-{month:02d} Hour {hour:02d}"):
                 try:
-                    # Open the NetCDF file
-                    with xr.open_dataset(nc_file) as ds:
+                    # Open the NetCDF file (only the channel, in chunks aligned to the tiles stored in the file)
+                    with open_daily_dataset(nc_file, variables=[channel]) as ds:
                         # Extract the 10.8 channel values for the specified hour
                         if channel in ds and "time" in ds.coords:
                             time_values = ds["time"].values
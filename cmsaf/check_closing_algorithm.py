@@ -1,6 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.ndimage import binary_closing
+from closing_functions import closing_sweep
 import rasterio
 from glob import glob
 
@@ -8,11 +8,10 @@ from glob import glob
 def binarize_image(image):
     return (image > 0).astype(np.uint8)
 
-# Function to apply binary closing with a square structure of given size
-def apply_closing(image, size):
-    structure = np.ones((size, size), dtype=np.uint8)
-    closed_image = binary_closing(image, structure=structure)
-    return closed_image
+# Function to apply binary closing with square structures of the given sizes (in one sweep)
+def apply_closing(image, sizes):
+    closed_images = closing_sweep(image, sizes)
+    return [closed_images[size] for size in sizes]
 
 # Function to identify and highlight closed points
 def identify_closed_points(original, closed):
@@ -64,7 +63,7 @@ def process_images(structure_sizes,image_paths, out_path):
         binarized_image = binarize_image(image)
 
         # Apply binary closing with different structure sizes
-        closed_images = [apply_closing(binarized_image, size) for size in structure_sizes]
+        closed_images = apply_closing(binarized_image, structure_sizes)
 
         # Identify closed points
         closed_points = [identify_closed_points(binarized_image, closed) for closed in closed_images]
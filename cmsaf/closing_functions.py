@@ -0,0 +1,105 @@
+"""
+Binary closing of stacks of cloud masks, e.g. all the timestamps of a day (time, lat, lon)
+or a batch of crops (n_crops, h, w), in a single call instead of a loop over the 2D images.
+
+The closing uses a square structure in the image plane that is trivial (length 1) along the
+stack axis, so each image is closed independently and the result is the same as applying
+scipy.ndimage.binary_closing with a (size, size) structure to each image.
+
+For sensitivity studies over many structure sizes, closing_sweep builds the square closing
+from separable running max/min filters along the rows and the columns, whose cost does not
+depend on the size of the structure, and can return only the counts of the newly closed pixels.
+
+@author: Daniele Corradini
+"""
+
+import numpy as np
+from scipy.ndimage import binary_closing, maximum_filter1d, minimum_filter1d
+from concurrent.futures import ThreadPoolExecutor
+
+
+def closing_structure(size, ndim=3):
+    """
+    Square structure of the given size in the last two dimensions, trivial along the others.
+
+    :param size: Side of the square structure in pixels.
+    :param ndim: Number of dimensions of the stack.
+    :return: Boolean array with shape (1, ..., size, size).
+    """
+    return np.ones((1,) * (ndim - 2) + (size, size), dtype=bool)
+
+
+def _close_chunk(stack, size, output, chunk):
+    binary_closing(stack[chunk], structure=closing_structure(size, stack.ndim), output=output[chunk])
+
+
+def stack_binary_closing(stack, sizes=3, n_threads=1):
+    """
+    Binary closing of each 2D image of a stack, for one or several structure sizes.
+
+    :param stack: Array with the images along the first axis, e.g. (time, lat, lon) or (n_crops, h, w).
+                  A single 2D image is also accepted. Non-zero values (including NaN) are True.
+    :param sizes: Side of the square structure, or list of sides (e.g. [2, 3, 4, 5, 6, 7, 8, 9]).
+    :param n_threads: Number of threads closing separate chunks of the stack (1 to run in the calling thread).
+    :return: Boolean array with the shape of the stack if sizes is an integer,
+             otherwise dictionary with the closed stack for each size.
+    """
+    stack = np.asarray(stack) != 0
+    single_size = np.isscalar(sizes)
+    sizes = [sizes] if single_size else list(sizes)
+
+    # chunks of images along the first axis, one per thread
+    if stack.ndim > 2 and n_threads > 1:
+        bounds = np.linspace(0, stack.shape[0], min(n_threads, stack.shape[0]) + 1).astype(int)
+        chunks = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+    else:
+        chunks = [Ellipsis]
+
+    closed = {size: np.empty_like(stack) for size in sizes}
+    tasks = [(size, chunk) for size in sizes for chunk in chunks]
+    if len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            list(executor.map(lambda task: _close_chunk(stack, task[0], closed[task[0]], task[1]), tasks))
+    else:
+        for size, chunk in tasks:
+            _close_chunk(stack, size, closed[size], chunk)
+
+    return closed[sizes[0]] if single_size else closed
+
+
+def _square_closing(stack, size):
+    # dilation then erosion in the last two dimensions, each as a running max/min along the rows and the columns.
+    # The outside of the image is False in both, and even sizes are shifted as in scipy.ndimage.binary_closing
+    dilation_origin = size % 2 - 1
+    closed = stack
+    for axis in (-1, -2):
+        closed = maximum_filter1d(closed, size, axis=axis, mode='constant', cval=0, origin=dilation_origin)
+    for axis in (-1, -2):
+        closed = minimum_filter1d(closed, size, axis=axis, mode='constant', cval=0)
+    return closed.astype(bool)
+
+
+def closing_sweep(stack, sizes, counts=False):
+    """
+    Binary closing of each 2D image of a stack for several square structure sizes, with separable
+    running max/min filters (same result as stack_binary_closing, at a cost independent of the size).
+
+    :param stack: Array with the images along the first axis, e.g. (time, lat, lon) or (n_crops, h, w).
+                  A single 2D image is also accepted. Non-zero values (including NaN) are True.
+    :param sizes: List of sides of the square structures, e.g. [2, 3, 4, 5, 6, 7, 8, 9].
+    :param counts: If True, return only the number of newly closed pixels (False in the stack, True
+                   after the closing) of each image instead of the closed stacks.
+    :return: Dictionary with, for each size, the closed stack (boolean array with the shape of the stack)
+             or the counts (integer, or array with the shape of the stack without the last two dimensions).
+    """
+    stack = (np.asarray(stack) != 0).view(np.uint8)
+
+    sweep = {}
+    for size in sizes:
+        closed = _square_closing(stack, size)
+        if counts:
+            # the closing only adds pixels inside the image, but it can remove True pixels at its border
+            sweep[size] = np.count_nonzero(closed & (stack == 0), axis=(-2, -1))
+        else:
+            sweep[size] = closed
+    return sweep
@@ -1,6 +1,5 @@
 import xarray as xr
 import numpy as np
-from scipy.ndimage import binary_closing
 from glob import glob
 import os
 from collections import defaultdict
@@ -8,6 +7,7 @@ import pandas as pd
 
 from process_cma_functions import plot_cloud_mask, count_granular_points_by_orography, plot_normalized_histogram, plot_monthly_granular_distribution
 from process_cma_functions import plot_normalized_histogram_from_csv, plot_monthly_granular_distribution_from_csv
+from closing_functions import closing_sweep
 
 # Define the path to the cloud mask files
 folder_path_1 = '/data/sat/msg/ml_train_crops/IR_108-WV_062-IR_039_2013-2014_128x128_EXPATS/nc_clouds/'
@@ -70,9 +70,10 @@ for filename in cma_filelist:
     lat = data['lat'].values
     lon = data['lon'].values
 
-    # Apply binary closing with two different structures
-    closed_mask_3x3 = binary_closing(cloud_mask, structure=np.ones((3, 3)))
-    closed_mask_5x5 = binary_closing(cloud_mask, structure=np.ones((5, 5)))
+    # Apply binary closing with two different structures in one sweep
+    closed_masks = closing_sweep(cloud_mask, [3, 5])
+    closed_mask_3x3 = closed_masks[3]
+    closed_mask_5x5 = closed_masks[5]
 
     # Identify patches by taking the difference between the original and closed mask
     granular_mask_3x3 = (closed_mask_3x3 - cloud_mask) == 1  # Where 1 represents patchy clear in cloudy areas
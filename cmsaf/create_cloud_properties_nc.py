@@ -1,23 +1,30 @@
+"""
+Merge the CM SAF CLAAS3 cloud properties (CPP: cot/cph/cwp/cre, CTX: ctt/ctp/cth, CMA: cma)
+regridded to the regular MSG grid into one file per day.
+
+The product files are matched by the timestamp in their filename and the timestamps are
+processed in parallel by a pool of workers. All the variables of a timestamp are regridded
+with a single gather (see regrid_cmsaf_functions.py). Categorical fields (cma, cph) are
+stored as int8. Timestamps with a missing product are not written and are reported in a
+csv file in the output folder.
+
+@author: Daniele Corradini
+"""
 import numpy as np
 import os
 import xarray as xr
 from glob import glob
 import pandas as pd
 import sys
+from datetime import datetime
+from functools import partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 #import own methods
 sys.path.append('/home/dcorradi/Documents/Codes/MSG-SEVIRI/')
-from process.regrid_functions import regrid_data, generate_regular_grid
-#from cmsaf.regrid_cmsaf import get_cmsaf_lat_lon
-
-def get_cmsaf_lat_lon(ds_cmsaf, ds_aux):
-    # Get lat lon from AUX file
-    grid_idx = ds_cmsaf.georef_offset_corrected.values
-    lat_aux = ds_aux['lat'].values[grid_idx]
-    #print('lat aux', lat_aux)
-    lon_aux = ds_aux['lon'].values[grid_idx]
-    #print('lon aux', lon_aux)
-    return  lat_aux[0,:,:], lon_aux[0,:,:]
+from process.regrid_functions import generate_regular_grid
+from cmsaf.regrid_cmsaf_functions import get_cmsaf_regrid_plan, regrid_cmsaf_variables
 
 def compress_and_save_old(ds, proj_file_path, filename_save):
     """
@@ -45,9 +52,10 @@ def compress_and_save_old(ds, proj_file_path, filename_save):
     print(f'{filename} product saved in {proj_file_path}\n')
 
 
-def compress_and_save(ds, proj_file_path, filename_save):
+def compress_and_save(ds, proj_file_path, filename_save, complevel=4):
     """
     Compresses and saves an xarray dataset in the netCDF format with specified compression settings.
+    Categorical variables are stored as int8 with -1 as fill value, the others as float32.
 
     Parameters:
     ds (xarray.Dataset): The dataset to be saved.
@@ -55,14 +63,21 @@ def compress_and_save(ds, proj_file_path, filename_save):
                           does not exist, it will be created.
     filename (str): The base name for the output file. The output filename will be derived from this,
                     removing any directory path and changing the extension to '.nc'.
+    complevel (int): zlib compression level.
     """
-    encoding = {var: {"zlib": True, "complevel": 9, "dtype": "float32"} for var in ds.data_vars}
+    encoding = {}
+    for var in ds.data_vars:
+        if var in categorical_variables:
+            encoding[var] = {"zlib": True, "complevel": complevel, "dtype": "int8", "_FillValue": -1}
+        else:
+            encoding[var] = {"zlib": True, "complevel": complevel, "shuffle": True, "dtype": "float32"}
     encoding.update({
         'time': {"units": "seconds since 2000-01-01", "dtype": "i4"},
         'lat': {"dtype": "float32"},
         'lon': {"dtype": "float32"}
     })
 
+    os.makedirs(proj_file_path, exist_ok=True)
     ds.to_netcdf(os.path.join(proj_file_path, filename_save), encoding=encoding)
     print(f'{filename_save} product saved in {proj_file_path}\n')
 
@@ -75,10 +90,11 @@ months = ['04', '05', '06', '07', '08', '09']
 lon_max, lon_min, lat_max, lat_min = 16.0, 5.0, 51.5, 42.0
 grid_size = 0.04
 
-#open dataset with aux info 
+#path of the aux file with the lat/lon of the CLAAS3 pixels
 cmsaf_aux_path = '/data/sat/msg/CM_SAF/CPP/2023/CM_SAF_CLAAS3_L2_AUX.nc' #"/data/sat/msg/CM_SAF/CM_SAF_CLAAS3_L2_AUX.nc"
-ds_aux = xr.open_dataset(cmsaf_aux_path,decode_times=False)
-#print(ds_aux) #TODO how to do in case the crop is wrong?
+
+# Paths of the CM SAF products
+cmsaf_path = '/data/sat/msg/CM_SAF/'
 
 #Define name of variables
 variable_mapping = {
@@ -87,135 +103,194 @@ variable_mapping = {
     "CMA": ["cma"]                #cloud mask
 }
 
-#find regular grid
-lat_points, lon_points = generate_regular_grid(lat_min, lat_max, lon_min, lon_max, grid_size)
-msg_lat_grid, msg_lon_grid = np.meshgrid(lat_points, lon_points, indexing='ij')
-print(msg_lat_grid.shape)
-#print(msg_lon_grid)
-
-for year in years:
-    for month in months:
-
-        # Paths and parameters
-        cmsaf_path = '/data/sat/msg/CM_SAF/'
-        cpp_folder = f'{cmsaf_path}CPP/{year}/{month}'
-        ctx_folder =  f'{cmsaf_path}CTX/{year}/{month}'
-        cma_folder =  f'{cmsaf_path}CMA/{year}/{month}'    
-
-        #output folder, create if don't exist
-        output_folder =f'{cmsaf_path}merged_cloud_properties/{year}/{month}/'
-        if not os.path.exists(output_folder):
-            # Create the directory if it doesn't exist
-            os.makedirs(output_folder) 
-
-        # Collect all file paths
-        cpp_files = sorted(glob(cpp_folder+ "/*/*.nc"))
-        ctx_files = sorted(glob(ctx_folder+ "/*/*.nc"))
-        cma_files = sorted(glob(cma_folder+ "/*/*.nc"))
-        print(len(cpp_files),len(ctx_files),len(cma_files))
-
-
-        if len(cpp_files) == len(ctx_files) and len(cma_files) == len(cpp_files):
-
-            # Create a DataFrame with the file paths
-            df_file_groups = pd.DataFrame({
-                "CPP": cpp_files,
-                "CTX": ctx_files,
-                "CMA": cma_files
-            })
-
-            #print(df_file_groups)
-
-            # Process each timestamp
-            n_files = len(cpp_files)
-
-            # initialize day variable
-            last_day = 0
-            #count = 0
-
-            for t in range(n_files):
-                ds_time = xr.open_dataset(cpp_files[t])
-                #get timestamp
-                timestamp = ds_time.time.values[0]
-                print(timestamp)
-
-                #extract day from time string
-                day = pd.to_datetime(timestamp).day
-                month =  pd.to_datetime(timestamp).month
-                year =  pd.to_datetime(timestamp).year 
-
-                #get lat lon
-                lat_aux, lon_aux = get_cmsaf_lat_lon(ds_time, ds_aux)
-                #print(lat_aux.shape)
-                #print(lon_aux.shape)
-
-                #initialize list of dataset to merge
-                datasets = []
-
-                #loop over the different file type
-                for key in df_file_groups.columns.tolist():
-                        #for each file type, open the correspondent dataset for the current timestamp
-                        ds = xr.open_dataset(df_file_groups.loc[t,key])
-                        #print(ds)
-                        #merge only the dataarry containig the relevant variables inside each dataset
-                        for var in variable_mapping[key]:
-                            if var in ds:
-                                datasets.append(ds[var])
-                #print(datasets)
-                
-                if datasets:
-                    merged_ds = xr.merge(datasets)
-                    #print(merged_ds)
-
-                    # Regrid each variable in the merged dataset
-                    regridded_data = {}
-                    for var in merged_ds:
-                        
-                        print(var)
-                        data = merged_ds[var].values[0,:,:]
-                        #print(np.sum(np.isnan(data)) / (data.shape[0]*data.shape[1]))
-                        print(lat_aux.shape, lon_aux.shape)
-                        print(msg_lat_grid.shape, msg_lon_grid.shape)
-                        print(data.shape)
-                        regridded_data[var] = regrid_data(lat_aux, lon_aux, data, msg_lat_grid, msg_lon_grid, 'nearest')
-                        print(regridded_data[var].shape)
-                           
-                        #print(np.sum(np.isnan(regridded_data[var])) / (msg_lat_grid.shape[0]*msg_lat_grid.shape[1]))
-                    #print(regridded_data)
-
-                    # Create an xarray Dataset
-                    regridded_ds = xr.Dataset()
-                    for var, data in regridded_data.items():
-                        regridded_ds[var] = xr.DataArray(data, dims=("lat", "lon"), coords={"lat": lat_points, "lon": lon_points})
-
-                    
-                    regridded_ds = regridded_ds.expand_dims('time', axis=0)
-                    #regridded_ds['time'] = pd.to_datetime([timestamp], format='%Y%m%d%H%M%S')
-                    regridded_ds['time'] = merged_ds['time']
-                    #print(regridded_ds)
-
-                    if day == last_day:
-                        ds_day = xr.concat([ds_day, regridded_ds], dim='time')
-
-                        #deal with the last timestep
-                        if t==n_files-1:
-                            filename = f"MCP_{year:04d}-{month:02d}-{day:02d}_regrid.nc"
-                            compress_and_save(ds_day,output_folder,filename)
-                    else:
-                        if t>0:
-                            #save the daily dataset 
-                            filename = f"MCP_{year:04d}-{month:02d}-{day-1:02d}_regrid.nc"
-                            compress_and_save(ds_day,output_folder,filename)
-                            #update dataset with the next day
-                        ds_day = regridded_ds
-                    #count+=1
-
-                    last_day = day
-                    #print(ds_day) 
-
-            print(f'Processing concluded for year {year} - month {month}!')
+#variables with categories (cloud mask, cloud phase), stored as int8
+categorical_variables = ['cma', 'cph']
+
+#zlib compression level of the daily files
+complevel = 4
+
+# number of worker processes used to process the timestamps in parallel
+n_workers = 8
+
+
+def get_cmsaf_timestamp(filename):
+    """
+    Get date and time from the filename of a CLAAS3 product.
+    example filename: CPPin20130401000000405SVMSG01UD.nc
+    """
+    return datetime.strptime(os.path.basename(filename)[5:19], "%Y%m%d%H%M%S")
+
+
+def match_product_files(product_files):
+    """
+    Match the files of the different products by the timestamp in their filename.
+
+    Parameters:
+    product_files (dict): List of files of each product, e.g. {'CPP': [...], 'CTX': [...], 'CMA': [...]}.
+
+    Returns:
+    tuple: Dictionary with the files of each product for the timestamps with all the products,
+           and dictionary with the list of missing products for the other timestamps, both sorted by time.
+    """
+    files_by_time = {}
+    for product, files in product_files.items():
+        for filename in files:
+            files_by_time.setdefault(get_cmsaf_timestamp(filename), {})[product] = filename
+
+    complete, missing = {}, {}
+    for timestamp in sorted(files_by_time):
+        missing_products = [product for product in product_files if product not in files_by_time[timestamp]]
+        if missing_products:
+            missing[timestamp] = missing_products
         else:
-            print('something wrong with the number of files')
-            exit()
+            complete[timestamp] = files_by_time[timestamp]
+    return complete, missing
+
+
+# aux dataset opened in this process (only used to build the index maps the first time)
+_aux_datasets = {}
+
+def process_cloud_properties_timestamp(files, aux_path, lat_grid, lon_grid):
+    """
+    Read the products of a timestamp and regrid all their variables to the regular grid with one gather.
+
+    Parameters:
+    files (dict): Path of the file of each product (keys of variable_mapping) for the timestamp.
+    aux_path (str): Path of the CLAAS3 aux file.
+    lat_grid (np.ndarray): 2D latitudes of the regular grid.
+    lon_grid (np.ndarray): 2D longitudes of the regular grid.
+
+    Returns:
+    xarray.Dataset: Regridded variables of the timestamp with a singleton 'time' dimension.
+    """
+    if aux_path not in _aux_datasets:
+        _aux_datasets[aux_path] = xr.open_dataset(aux_path, decode_times=False)
+
+    datasets = []
+    for product, filename in files.items():
+        with xr.open_dataset(filename) as ds:
+            variables = [var for var in variable_mapping[product] if var in ds]
+            datasets.append(ds[variables + ['georef_offset_corrected']].load())
+    merged_ds = xr.merge(datasets, compat='override')
+
+    #get the nearest neighbour index map for the georeference offset of the file
+    #(computed once from the aux file and saved next to it)
+    regrid_plan = get_cmsaf_regrid_plan(merged_ds, _aux_datasets[aux_path], aux_path, lat_grid, lon_grid)
+
+    #regrid all the variables of the timestamp with a single gather
+    variables = [var for var in merged_ds.data_vars if var != 'georef_offset_corrected']
+    regridded_data = regrid_cmsaf_variables(merged_ds, variables, regrid_plan)
+
+    regridded_ds = xr.Dataset()
+    lat_points, lon_points = lat_grid[:, 0], lon_grid[0, :]
+    for var, data in regridded_data.items():
+        regridded_ds[var] = xr.DataArray(data, dims=("lat", "lon"), coords={"lat": lat_points, "lon": lon_points})
+
+    regridded_ds = regridded_ds.expand_dims('time', axis=0)
+    regridded_ds['time'] = merged_ds['time'].values[:1]
+    return regridded_ds
+
+
+def save_missing_products(missing, output_folder, year, month):
+    """
+    Write the timestamps with missing products to a csv file in the output folder.
+    The file is written also when no product is missing, so a csv of a previous run is never left behind.
+    """
+    df_missing = pd.DataFrame({'timestamp': list(missing.keys()),
+                               'missing_products': [' '.join(products) for products in missing.values()]})
+    missing_path = os.path.join(output_folder, f'missing_products_{year}-{month}.csv')
+    df_missing.to_csv(missing_path, index=False)
+    print(f'{len(missing)} timestamps with missing products listed in {missing_path}')
+
+
+def map_bounded(executor, func, items, max_pending):
+    """
+    Like executor.map, returns the results in the order of the items, but submits a new item only
+    when one of the first max_pending is collected, so the results waiting to be collected never
+    exceed max_pending.
+
+    Parameters:
+    executor (concurrent.futures.Executor): Pool of workers.
+    func (callable): Function applied to each item.
+    items (iterable): Items to process.
+    max_pending (int): Maximum number of items submitted and not yet collected.
+
+    Returns:
+    generator: Results of func for each item.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def create_cloud_properties_month(year, month, lat_grid, lon_grid, n_workers=n_workers):
+    """
+    Create the daily files of the merged cloud properties of a month.
+
+    Parameters:
+    year (str): Year of the data.
+    month (str): Month of the data (two digits).
+    lat_grid (np.ndarray): 2D latitudes of the regular grid.
+    lon_grid (np.ndarray): 2D longitudes of the regular grid.
+    n_workers (int): Number of worker processes.
+    """
+    #output folder, create if don't exist
+    output_folder = f'{cmsaf_path}merged_cloud_properties/{year}/{month}/'
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Collect all file paths
+    product_files = {product: sorted(glob(f'{cmsaf_path}{product}/{year}/{month}/*/*.nc')) for product in variable_mapping}
+    print({product: len(files) for product, files in product_files.items()})
+
+    # Match the files by timestamp
+    complete, missing = match_product_files(product_files)
+    save_missing_products(missing, output_folder, year, month)
+
+    process = partial(process_cloud_properties_timestamp, aux_path=cmsaf_aux_path, lat_grid=lat_grid, lon_grid=lon_grid)
+
+    # the timestamps are processed in parallel and returned in time order, one day is kept in memory
+    # (at most 2 timestamps per worker are submitted ahead, while a day is saved the workers wait)
+    day_datasets = []
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for timestamp, ds_time in zip(complete, map_bounded(executor, process, complete.values(), 2 * n_workers)):
+            print(timestamp)
+            if day_datasets and timestamp.date() != day_datasets[0][0].date():
+                save_day(day_datasets, output_folder)
+                day_datasets = []
+            day_datasets.append((timestamp, ds_time))
+
+    if day_datasets:
+        save_day(day_datasets, output_folder)
+
+    print(f'Processing concluded for year {year} - month {month}!')
+
+
+def save_day(day_datasets, output_folder):
+    """
+    Concatenate the timestamps of a day and save them in the daily file.
+
+    Parameters:
+    day_datasets (list): List of (timestamp, xarray.Dataset) of the same day.
+    output_folder (str): Folder of the daily files.
+    """
+    date = day_datasets[0][0]
+    ds_day = xr.concat([ds_time for _, ds_time in day_datasets], dim='time')
+    filename = f"MCP_{date:%Y-%m-%d}_regrid.nc"
+    compress_and_save(ds_day, output_folder, filename, complevel)
+
+
+if __name__ == "__main__":
+    #find regular grid
+    lat_points, lon_points = generate_regular_grid(lat_min, lat_max, lon_min, lon_max, grid_size)
+    msg_lat_grid, msg_lon_grid = np.meshgrid(lat_points, lon_points, indexing='ij')
+    print(msg_lat_grid.shape)
+
+    for year in years:
+        for month in months:
+            create_cloud_properties_month(year, month, msg_lat_grid, msg_lon_grid)
 
-#2522115 nohup
\ No newline at end of file
+#2522115 nohup
@@ -2,8 +2,13 @@ import xarray as xr
 import numpy as np
 import pandas as pd
 import glob
-from scipy.ndimage import binary_closing
 from datetime import datetime, timedelta
+import os
+import sys
+
+#import own methods (from the root of the repository)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from cmsaf.closing_functions import stack_binary_closing
 
 # Define paths
 cmsaf_folder = "/data1/crops/cmsaf_2013-2014-2015-2016_expats/nc_clouds/"
@@ -23,8 +28,7 @@ closing_strucutre_sizes = [2,3,4,5,6,7,8,9,10]
 
 def apply_closing(mask, structure_size):
     """Applies the binary closing algorithm with a given kernel size."""
-    structure = np.ones((structure_size, structure_size), dtype=bool)
-    closed_mask = binary_closing(mask, structure=structure)
+    closed_mask = stack_binary_closing(mask, structure_size)
     holes = (closed_mask - mask) == 1  # Find holes in the mask
     return holes
 
@@ -10,15 +10,13 @@ import matplotlib.colors as mcolors
 from scipy.interpolate import griddata
 from datetime import datetime, timedelta
 import os
-from scipy.ndimage import binary_closing
 import cmcrameri.cm as cmc
+import sys
 
+#import own methods (from the root of the repository)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from cmsaf.closing_functions import closing_sweep
 
-# Function to apply binary closing with a square structure of given size
-def apply_closing(image, size):
-    structure = np.ones((size, size), dtype=np.uint8)
-    closed_image = binary_closing(image, structure=structure)
-    return closed_image
 
 structure_sizes = [1, 3]
 
@@ -251,9 +249,11 @@ for modis_file in modis_files:
         print('not enough point to regrid')
         continue
 
+    #Apply closing algorithm for all the structure sizes in one sweep
+    closed_cloud_masks = closing_sweep(cmsaf_cloud_mask, structure_sizes)
+
     for structure in structure_sizes:
-        #Apply closing algorithm
-        cmsaf_cloud_mask = apply_closing(cmsaf_cloud_mask, structure)
+        cmsaf_cloud_mask = closed_cloud_masks[structure]
 
         # Mask the CMSAF data based on the common boundaries
         mask_lat_cmsaf = (cmsaf_lat_grid > latmin) & (cmsaf_lat_grid < latmax)
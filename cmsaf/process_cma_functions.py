@@ -2,12 +2,19 @@ import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import numpy as np
-from scipy.spatial import cKDTree
 import seaborn as sns
 import pandas as pd
 import xarray as xr
 from glob import glob
 import os
+import sys
+
+#import own methods (from the process folder of the repository)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'process'))
+from static_geometry import regular_grid_indices, classify_elevation
+
+# orographic categories, in the order of the classes of classify_elevation
+orography_categories = ['flat', 'hills', 'mountains']
 
 
 
@@ -203,16 +210,38 @@ def plot_normalized_histogram(aggregated_counts, total_points_by_category, outpu
 
 
 
+# orographic classes of the DEM datasets already used, keyed by dataset
+_elevation_classes = {}
+
+def get_elevation_classes(ds_orography):
+    """
+    Orographic class (0 flat, 1 hills, 2 mountains) of each DEM pixel, computed only once per dataset.
+
+    Parameters:
+    - ds_orography (xarray.Dataset): Orography dataset with a variable named 'DEM' (in meters) and regular coordinates 'lat' and 'lon'.
+
+    Returns:
+    - tuple: 1D latitudes and longitudes of the DEM and 2D array of the orographic classes.
+    """
+    key = id(ds_orography)
+    if key not in _elevation_classes:
+        elevation = ds_orography['DEM'].transpose('lat', 'lon').values
+        _elevation_classes[key] = (ds_orography, ds_orography['lat'].values, ds_orography['lon'].values,
+                                   classify_elevation(elevation))
+    return _elevation_classes[key][1:]
+
+
 def count_granular_points_by_orography(granular_mask_3x3, granular_mask_5x5, lat, lon, ds_orography):
     """
     Counts the number of granular points in each orographic category (flat, hills, mountains) for both 3x3 and 5x5 masks.
+    The category of each pixel is the one of the nearest DEM pixel, found by index arithmetic on the regular grids.
 
     Parameters:
-    - granular_mask_3x3 (ndarray): Granular regions identified in the (3x3) closed cloud mask.
-    - granular_mask_5x5 (ndarray): Granular regions identified in the (5x5) closed cloud mask.
+    - granular_mask_3x3 (ndarray): Granular regions identified in the (3x3) closed cloud mask, with shape (lat, lon).
+    - granular_mask_5x5 (ndarray): Granular regions identified in the (5x5) closed cloud mask, with shape (lat, lon).
     - lat (ndarray): Latitude array of the cloud mask.
     - lon (ndarray): Longitude array of the cloud mask.
-    - ds_orography (xarray.Dataset): Orography dataset with a variable named 'elevation' (in meters) and coordinates 'lat' and 'lon'.
+    - ds_orography (xarray.Dataset): Orography dataset with a variable named 'DEM' (in meters) and coordinates 'lat' and 'lon'.
     
     Returns:
     - dict: A dictionary with counts of granular points in each orographic level for 3x3 and 5x5 masks.
@@ -220,62 +249,24 @@ def count_granular_points_by_orography(granular_mask_3x3, granular_mask_5x5, lat
                 '3x3': {'flat': int, 'hills': int, 'mountains': int},
                 '5x5': {'flat': int, 'hills': int, 'mountains': int}
             }
+    - dict: Total number of points in each orographic level.
     """
-    
-    # Define elevation categories in meters
-    flat_threshold = 200
-    hill_threshold = 600
-    
-    # Flatten the latitude and longitude arrays for cloud mask
-    lon_grid, lat_grid = np.meshgrid(lon, lat, indexing='ij')
-    cloud_mask_points = np.array([lat_grid.ravel(), lon_grid.ravel()]).T
-    
-    # Create KDTree from orography dataset coordinates for fast nearest-neighbor lookup
-    lat_oro = ds_orography['lat'].values
-    lon_oro = ds_orography['lon'].values
-    lon_grid_oro, lat_grid_oro = np.meshgrid(lon_oro, lat_oro,indexing='ij')
-    orography_points = np.array([lat_grid_oro.ravel(), lon_grid_oro.ravel()]).T
-    tree = cKDTree(orography_points)
-    
-    # Find closest orography points for each cloud mask point
-    _, indices = tree.query(cloud_mask_points)
-    
-    # Get elevation values at nearest points
-    elevation = ds_orography['DEM'].values.ravel()[indices].reshape(lat_grid.shape)
-    
-    # Initialize counters for each category and mask
+    lat_oro, lon_oro, elevation_classes = get_elevation_classes(ds_orography)
+
+    # orographic class of the crop pixels (lat, lon)
+    i = regular_grid_indices(lat, lat_oro)
+    j = regular_grid_indices(lon, lon_oro)
+    crop_classes = elevation_classes[np.ix_(i, j)]
+
+    def count_by_category(classes):
+        return dict(zip(orography_categories, np.bincount(classes, minlength=len(orography_categories)).tolist()))
+
     counts = {
-        '3x3': {'flat': 0, 'hills': 0, 'mountains': 0},
-        '5x5': {'flat': 0, 'hills': 0, 'mountains': 0}
+        '3x3': count_by_category(crop_classes[granular_mask_3x3]),
+        '5x5': count_by_category(crop_classes[granular_mask_5x5]),
     }
-    
-    total_points = {'flat': 0, 'hills': 0, 'mountains': 0}
-    
-    # Define function to categorize elevation
-    def categorize(elevation_value):
-        if elevation_value < flat_threshold:
-            return 'flat'
-        elif elevation_value < hill_threshold:
-            return 'hills'
-        else:
-            return 'mountains'
-    
-    # Count total points by category
-    for i in range(lat_grid.shape[0]):
-        for j in range(lat_grid.shape[1]):
-            category = categorize(elevation[i, j])
-            total_points[category] += 1
-    
-    # Count granular points for the 3x3 mask
-    for i, j in zip(*np.where(granular_mask_3x3)):
-        category = categorize(elevation[i, j])
-        counts['3x3'][category] += 1
-    
-    # Count granular points for the 5x5 mask
-    for i, j in zip(*np.where(granular_mask_5x5)):
-        category = categorize(elevation[i, j])
-        counts['5x5'][category] += 1
-    
+    total_points = count_by_category(crop_classes.ravel())
+
     return counts, total_points
 
 
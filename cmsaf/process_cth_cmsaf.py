@@ -5,8 +5,8 @@ Processing CTH data from CMSAF to make it compatible to Satpy for the parallax c
 """
 
 from glob import glob
-import xarray as xr
-import os
+
+from process_cth_functions import convert_cth_file, convert_in_parallel
 
 ### Define Paths ###
 
@@ -15,58 +15,20 @@ year = '2014'
 #path where cth data are stored
 path_to_files = '/data/sat/msg/CM_SAF/CTX/'+year+'/0*/*/'
 
-#Path output
-path_out = '/data/sat/msg/CM_SAF/CTH_processed/'+year+'/' 
-
-#open all files in directory 
-nc_file = "CTX*.nc" #'CTXin20210712000000405SVMSGI1UD.nc'
-fnames = sorted(glob(path_to_files+nc_file))
-print(fnames)
-
-#Read and process CTH data at different temporal steps 
-for t,f in enumerate(fnames):
-    print(f.split('/')[-1])
-
-    #get time
-    time = f.split('/')[-1].split('.')[0][5:13]
-    #print(time)
-    month = time[4:6]
-    day = time[6:8]
-
-    ### Open Netcdf data and read variables ###
-    ds_cth_cmsaf = xr.open_dataset(f)
-
-    #adapt cth variable name
-    ds_cth_cmsaf = ds_cth_cmsaf.rename({'cth': 'ctth_alti'})
-    #print("Updated variables in the dataset:", ds_cth_cmsaf.ctth_alti.values)
-
-    # Assign satellite parameters to ctth_alti variables
-    ds_cth_cmsaf['ctth_alti'].attrs['satellite_nominal_latitude'] = ds_cth_cmsaf.subsatellite_lat.values[0]
-    ds_cth_cmsaf['ctth_alti'].attrs['satellite_nominal_longitude'] = ds_cth_cmsaf.subsatellite_lon.values[0]
-    ds_cth_cmsaf['ctth_alti'].attrs['satellite_nominal_altitude'] = ds_cth_cmsaf.subsatellite_alt.values[0]
-
-    #print(ds_cth_cmsaf['ctth_alti'].attrs)
-
-    filename_save = f.split('/')[-1]
-
-    path_output = path_out+'/'+month+'/'+day+'/'
-
-    # Check if the directory exists
-    if not os.path.exists(path_output):
-        # Create the directory if it doesn't exist
-        os.makedirs(path_output)
-
-    ds_cth_cmsaf.to_netcdf(path_output+filename_save)
-    print(f'\nfile {filename_save} is saved')
-
-    #exit()
-    
-
-
-
-        
+#Path output (files are saved in year/month/day folders)
+path_out = '/data/sat/msg/CM_SAF/CTH_processed/'
 
+#number of parallel processes (None: number of CPUs)
+n_workers = None
 
+if __name__ == "__main__":
+    #open all files in directory 
+    nc_file = "CTX*.nc" #'CTXin20210712000000405SVMSGI1UD.nc'
+    fnames = sorted(glob(path_to_files+nc_file))
+    print(f'{len(fnames)} files found')
 
+    #Convert the CTH data at different temporal steps, skipping the files already converted
+    results = convert_in_parallel(convert_cth_file, fnames, n_workers, path_out=path_out)
 
-    
+    converted = sum(1 for result in results.values() if result and result[1])
+    print(f'\n{converted} files converted, {len(fnames)-converted} skipped or failed')
@@ -5,10 +5,10 @@ Processing CTH data from CMSAF to make it compatible to Satpy for the parallax c
 """
 # %%
 from glob import glob
-import xarray as xr
-import os
 import numpy as np
 
+from process_cth_functions import convert_cth_file, convert_in_parallel
+
 # %%
 ### Define Paths ###
 
@@ -21,61 +21,23 @@ path_out = '/data/sat/msg/CM_SAF/CTH_processed'
 nc_file = "CTX*.nc" #'CTXin20210712000000405SVMSGI1UD.nc'
 
 # %%
-def process_cth_files_of_month(year, month):
+def process_cth_files_of_month(year, month, n_workers=None):
 
     #open all files in directory 
     fnames = sorted(glob(f"{path_to_files}/{year:04d}/{month:02d}/*/{nc_file}"))
-    
-    # get all files that are already processed
-    files_processed = sorted(glob(f"{path_out}/{year:04d}/{month:02d}/*/{nc_file}"))
-
-    fnames_processed = [os.path.basename(f) for f in files_processed]
-    missing_files = [f for f in fnames if os.path.basename(f) not in fnames_processed]
 
     # CTXin20130401234500405SVMSG01UD.nc
-    # get files in CTX folder that are not present in CTH_processed folder
-    # fnames_to_process = list(set(fnames) - set(fnames_processed))
-    if len(missing_files) > 0:
+    # convert the files in CTX folder, the ones already present with the same size
+    # in CTH_processed folder are skipped
+    if len(fnames) > 0:
         print("----", year, month)
-        print(f"{len(missing_files)} files need to be processed")
-
-        # loop over missing files and process them for satpy usage
-        for t, f in enumerate(missing_files):
-            if t%100==0:
-                print(f"{t}/{len(missing_files)}")
-            process_single_cth_file(f)
+        print(f"{len(fnames)} files to check")
+        convert_in_parallel(convert_cth_file, fnames, n_workers, path_out=path_out)
 
 def process_single_cth_file(f):
-
-    #get time
-    time = f.split('/')[-1].split('.')[0][5:13]
-    #print(time)
-    month = time[4:6]
-    day = time[6:8]
-
-    ### Open Netcdf data and read variables ###
-    ds_cth_cmsaf = xr.open_dataset(f)
-
-    #adapt cth variable name
-    ds_cth_cmsaf = ds_cth_cmsaf.rename({'cth': 'ctth_alti'})
-    #print("Updated variables in the dataset:", ds_cth_cmsaf.ctth_alti.values)
-
-    # Assign satellite parameters to ctth_alti variables
-    ds_cth_cmsaf['ctth_alti'].attrs['satellite_nominal_latitude'] = ds_cth_cmsaf.subsatellite_lat.values[0]
-    ds_cth_cmsaf['ctth_alti'].attrs['satellite_nominal_longitude'] = ds_cth_cmsaf.subsatellite_lon.values[0]
-    ds_cth_cmsaf['ctth_alti'].attrs['satellite_nominal_altitude'] = ds_cth_cmsaf.subsatellite_alt.values[0]
-
-    # get output filename
-    filename_save = f.split('/')[-1]
-    path_output = path_out+'/'+month+'/'+day+'/'
-
-    # Check if the directory exists
-    if not os.path.exists(path_output):
-        # Create the directory if it doesn't exist
-        os.makedirs(path_output)
-
-    # save to new location
-    ds_cth_cmsaf.to_netcdf(path_output+filename_save)
+    # convert and save to new location (year/month/day folders)
+    path_output, converted = convert_cth_file(f, path_out)
+    return path_output
 
         
 # %%
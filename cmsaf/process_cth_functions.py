@@ -2,6 +2,13 @@ import xarray as xr
 import pandas as pd
 import datetime
 import numpy as np
+import os
+import hashlib
+import tarfile
+import fnmatch
+import netCDF4
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
 
 def insert_time_attr(ds):
     # Step 1: Extract the time value
@@ -118,3 +125,158 @@ def insert_lat_lon(ds, aux_ds):
         ds = ds.drop_vars('y')
     
     return ds
+
+
+def get_cth_output_path(filename, path_out):
+    """
+    Path of the processed CTH file, in year/month/day folders as the CTX files.
+    CTXin20210712000000405SVMSGI1UD.nc -> path_out/2021/07/12/CTXin20210712000000405SVMSGI1UD.nc
+    """
+    time = os.path.basename(filename).split('.')[0][5:13]
+    return os.path.join(path_out, time[:4], time[4:6], time[6:8], os.path.basename(filename))
+
+
+def is_cth_file_converted(path_output, source_size, source_checksum=None):
+    """
+    Check if the processed CTH file exists and was converted from a source file
+    with the same size (and checksum, if given).
+    """
+    if not os.path.exists(path_output):
+        return False
+    try:
+        with netCDF4.Dataset(path_output) as nc:
+            attrs = nc.__dict__
+    except OSError:
+        # unreadable or partial file, convert it again
+        return False
+    if attrs.get('source_size') != source_size:
+        return False
+    return source_checksum is None or attrs.get('source_checksum') == source_checksum
+
+
+def copy_with_checksum(fsrc, fdst, chunk_size=1 << 20):
+    """
+    Copy a file object to another, computing the md5 checksum of the content.
+    """
+    md5 = hashlib.md5()
+    for chunk in iter(lambda: fsrc.read(chunk_size), b''):
+        md5.update(chunk)
+        fdst.write(chunk)
+    return md5.hexdigest()
+
+
+def write_satpy_cth_file(fsrc, path_output, source_size):
+    """
+    Write the CTX file read from fsrc as a CTH file compatible with Satpy for the parallax correction.
+    The file is copied as it is and only the header is changed in place: the 'cth' variable is
+    renamed to 'ctth_alti' and the sub-satellite position is added to its attributes, so the data
+    are not decoded and encoded again. The file is written to a temporary path and moved when complete.
+
+    :param fsrc: Binary file object of the CTX file (opened file or member of a tar archive).
+    :param path_output: Path of the processed CTH file.
+    :param source_size: Size in bytes of the CTX file, stored in the attributes to skip it next time.
+    """
+    os.makedirs(os.path.dirname(path_output), exist_ok=True)
+    tmp_path = f'{path_output}.{os.getpid()}.tmp'
+
+    try:
+        with open(tmp_path, 'wb') as fdst:
+            checksum = copy_with_checksum(fsrc, fdst)
+
+        with netCDF4.Dataset(tmp_path, 'r+') as nc:
+            #adapt cth variable name
+            nc.renameVariable('cth', 'ctth_alti')
+
+            # Assign satellite parameters to ctth_alti variables
+            nc['ctth_alti'].setncatts({
+                'satellite_nominal_latitude': nc['subsatellite_lat'][0],
+                'satellite_nominal_longitude': nc['subsatellite_lon'][0],
+                'satellite_nominal_altitude': nc['subsatellite_alt'][0]
+            })
+
+            # source of the file, to skip it if converted again
+            nc.setncatts({'source_size': source_size, 'source_checksum': checksum})
+
+        os.replace(tmp_path, path_output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def convert_cth_file(f, path_out, check_checksum=False):
+    """
+    Convert a CTX file to a CTH file compatible with Satpy, skipping it if already converted.
+
+    :param f: Path to the CTX file.
+    :param path_out: Base output folder of the processed CTH files.
+    :param check_checksum: If True, also the checksum of the source file is compared to skip it.
+    :return: Path of the processed CTH file and True if it was converted, False if skipped.
+    """
+    path_output = get_cth_output_path(f, path_out)
+    source_size = os.path.getsize(f)
+
+    source_checksum = None
+    if check_checksum:
+        with open(f, 'rb') as fsrc, open(os.devnull, 'wb') as fnull:
+            source_checksum = copy_with_checksum(fsrc, fnull)
+
+    if is_cth_file_converted(path_output, source_size, source_checksum):
+        return path_output, False
+
+    with open(f, 'rb') as fsrc:
+        write_satpy_cth_file(fsrc, path_output, source_size)
+    return path_output, True
+
+
+def convert_cth_tar(tar_file, path_out, nc_file='CTX*.nc'):
+    """
+    Convert the CTX files contained in a tar archive, streaming them out of the archive
+    without extracting it to disk. Files already converted (same size) are skipped.
+
+    :param tar_file: Path to the tar archive.
+    :param path_out: Base output folder of the processed CTH files.
+    :param nc_file: Pattern of the CTX file names in the archive.
+    :return: Number of converted and skipped files.
+    """
+    converted, skipped = 0, 0
+    with tarfile.open(tar_file, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile() or not fnmatch.fnmatch(os.path.basename(member.name), nc_file):
+                continue
+
+            path_output = get_cth_output_path(member.name, path_out)
+            if is_cth_file_converted(path_output, member.size):
+                skipped += 1
+                continue
+
+            write_satpy_cth_file(tar.extractfile(member), path_output, member.size)
+            converted += 1
+
+    return converted, skipped
+
+
+def convert_in_parallel(function, items, n_workers=None, **kwargs):
+    """
+    Run a conversion function on each item (CTX file or tar archive) in a pool of processes.
+
+    :param function: convert_cth_file or convert_cth_tar.
+    :param items: List of paths to convert.
+    :param n_workers: Number of processes (default: number of CPUs).
+    :param kwargs: Other arguments of the conversion function.
+    :return: Dictionary with the result of each item, None for the items that failed.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(function, item, **kwargs): item for item in items}
+
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except Exception as e:
+                print(f"Error processing {item}: {e}")
+                results[item] = None
+            if i % 100 == 0:
+                print(f"{i}/{len(items)}")
+
+    return results
@@ -11,7 +11,8 @@ import xarray as xr
 
 #import own methods
 sys.path.append('/home/dcorradi/Documents/Codes/MSG-SEVIRI/')
-from process.regrid_functions import regrid_data, generate_regular_grid
+from process.regrid_functions import generate_regular_grid
+from cmsaf.regrid_cmsaf_functions import get_cmsaf_lat_lon, get_cmsaf_regrid_plan, regrid_cmsaf_variables
 
 #Year of data
 years = ['2013']
@@ -26,15 +27,6 @@ lat_points, lon_points = generate_regular_grid(latmin,latmax,lonmin,lonmax,0.04)
 msg_lat_grid, msg_lon_grid = np.meshgrid(lat_points,lon_points,indexing='ij')
 #print(np.shape(msg_lat_grid))
 
-def get_cmsaf_lat_lon(ds_cmsaf, ds_aux):
-        # Get lat lon from AUX file
-        grid_idx = ds_cmsaf.georef_offset_corrected.values
-        lat_aux = ds_aux['lat'].values[grid_idx]
-        #print('lat aux', lat_aux)
-        lon_aux = ds_aux['lon'].values[grid_idx]
-        #print('lon aux', lon_aux)
-        return  lat_aux, lon_aux
-
 for year in years:
     # Define the folder of the CMSAF file to regrid
     cmsaf_folder = "/data/sat/msg/CM_SAF/CTX/"+year+"/*/*/"
@@ -65,46 +57,46 @@ for year in years:
         month = str(time).split('-')[1]
         day = str(time).split('-')[2][0:2]
 
-        # Get the lat/lon from auxiliary file
-        lat_aux, lon_aux = get_cmsaf_lat_lon(ds_cmsaf, ds_aux)
+        # Get the nearest neighbour index map for the georeference offset of the file
+        # (computed once from the auxiliary file and saved next to it)
+        regrid_plan = get_cmsaf_regrid_plan(ds_cmsaf, ds_aux, cmsaf_aux_path, msg_lat_grid, msg_lon_grid)
+
+        # Regrid all the variables with a single gather
+        regridded_vars = regrid_cmsaf_variables(ds_cmsaf, variable_names, regrid_plan)
 
         # Create an empty xarray Dataset for regridded data
         ds_regridded = xr.Dataset()
 
-        # Loop through the variables to regrid
-        for var_name in variable_names:  # Add all variable names here
-            if var_name in ds_cmsaf.variables:
-                print(f"Regridding variable: {var_name}")
-                
-                # Extract variable data
-                var_data = ds_cmsaf[var_name].values[0, :, :]
+        # Loop through the regridded variables
+        for var_name, regridded_data in regridded_vars.items():
+            print(f"Regridded variable: {var_name}")
 
-                if var_name == 'ctp':
-                    print(var_data)
-                    # Plot the data before the regridding, usinf cartopy
-                    print(lon_aux.shape, lat_aux.shape, var_data.shape)
-                    import matplotlib.pyplot as plt
-                    import cartopy.crs as ccrs
-                    fig, ax = plt.subplots(1,1, figsize=(8, 8), subplot_kw={'projection': ccrs.PlateCarree()})
-                    plt.pcolormesh(lon_aux.squeeze(), lat_aux.squeeze(), var_data, transform=ccrs.PlateCarree(),  cmap='Greys_r')
-                    ax.coastlines()
-                    plt.savefig(f'/home/dcorradi/Documents/Fig/cma/CTP_before_regrid_{time}.png')
-                    plt.close()
-                    exit()
-                
-                # Regrid the data
-                regridded_data = regrid_data(lat_aux, lon_aux, var_data, msg_lat_grid, msg_lon_grid, 'nearest')
-                
-                # Create a DataArray for the regridded data
-                regridded_da = xr.DataArray(
-                    regridded_data,
-                    dims=("lat", "lon"),
-                    coords={"lat": lat_points, "lon": lon_points},
-                    name=var_name
-                )
-                
-                # Add the regridded DataArray to the regridded dataset
-                ds_regridded[var_name] = regridded_da
+            if var_name == 'ctp':
+                # Get the lat/lon from auxiliary file
+                lat_aux, lon_aux = get_cmsaf_lat_lon(ds_cmsaf, ds_aux)
+                var_data = ds_cmsaf[var_name].values[0, :, :]
+                print(var_data)
+                # Plot the data before the regridding, usinf cartopy
+                print(lon_aux.shape, lat_aux.shape, var_data.shape)
+                import matplotlib.pyplot as plt
+                import cartopy.crs as ccrs
+                fig, ax = plt.subplots(1,1, figsize=(8, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+                plt.pcolormesh(lon_aux.squeeze(), lat_aux.squeeze(), var_data, transform=ccrs.PlateCarree(),  cmap='Greys_r')
+                ax.coastlines()
+                plt.savefig(f'/home/dcorradi/Documents/Fig/cma/CTP_before_regrid_{time}.png')
+                plt.close()
+                exit()
+
+            # Create a DataArray for the regridded data
+            regridded_da = xr.DataArray(
+                regridded_data,
+                dims=("lat", "lon"),
+                coords={"lat": lat_points, "lon": lon_points},
+                name=var_name
+            )
+            
+            # Add the regridded DataArray to the regridded dataset
+            ds_regridded[var_name] = regridded_da
 
         # Add a new dimension for the time coordinate
         ds_regridded = ds_regridded.expand_dims('time', axis=0)
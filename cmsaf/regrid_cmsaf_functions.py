@@ -0,0 +1,95 @@
+"""
+Regridding of the CM SAF CLAAS3 products (CMA, CTX, CPP) to the regular MSG grid.
+
+The lat/lon of the CLAAS3 pixels are not in the product files but in the AUX file,
+with one field for each georeference offset (georef_offset_corrected of the product).
+For a given offset and target grid, the nearest CLAAS3 pixel of each grid point never
+changes, so this index map is computed only once, saved next to the AUX file and then
+used to regrid all the variables of a file with a single gather.
+
+@author: Daniele Corradini
+"""
+
+import os
+import sys
+import numpy as np
+
+#import own methods (from the root of the repository)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from process.regrid_functions import RegridPlan, grid_hash
+
+
+def get_georef_offset(ds_cmsaf):
+    """
+    Georeference offset of a CLAAS3 product, i.e. the index of its lat/lon fields in the AUX file.
+
+    :param ds_cmsaf: xarray.Dataset of the CLAAS3 product.
+    :return: Offset (int).
+    """
+    return int(np.ravel(ds_cmsaf['georef_offset_corrected'].values)[0])
+
+
+def get_cmsaf_lat_lon(ds_cmsaf, ds_aux):
+    """
+    Lat/lon of the pixels of a CLAAS3 product, read from the AUX file for the offset of the product.
+
+    :param ds_cmsaf: xarray.Dataset of the CLAAS3 product.
+    :param ds_aux: xarray.Dataset of the AUX file (CM_SAF_CLAAS3_L2_AUX.nc).
+    :return: 2D arrays of latitudes and longitudes.
+    """
+    offset = get_georef_offset(ds_cmsaf)
+    lat_aux = ds_aux['lat'][offset].values
+    lon_aux = ds_aux['lon'][offset].values
+    return lat_aux, lon_aux
+
+
+# index maps already used in this process, keyed by AUX file, offset and target grid
+_index_maps = {}
+
+def get_cmsaf_regrid_plan(ds_cmsaf, ds_aux, aux_path, lat_grid, lon_grid):
+    """
+    Nearest neighbour index map from the CLAAS3 pixels to a regular grid for the georeference offset
+    of the product. The map is built from the AUX lat/lon only the first time, then it is loaded from
+    the file saved next to the AUX file (one file per offset and target grid).
+
+    :param ds_cmsaf: xarray.Dataset of the CLAAS3 product.
+    :param ds_aux: xarray.Dataset of the AUX file.
+    :param aux_path: Path of the AUX file.
+    :param lat_grid: 2D array of latitudes of the regular grid.
+    :param lon_grid: 2D array of longitudes of the regular grid.
+    :return: RegridPlan object (nearest).
+    """
+    offset = get_georef_offset(ds_cmsaf)
+    key = (aux_path, offset, grid_hash(lat_grid, lon_grid, method='nearest'))
+    if key in _index_maps:
+        return _index_maps[key]
+
+    aux_name = os.path.splitext(os.path.basename(aux_path))[0]
+    map_path = os.path.join(os.path.dirname(aux_path), f'{aux_name}_index_map_offset{offset}_{key[2]}.npz')
+    if os.path.exists(map_path):
+        plan = RegridPlan.load(map_path)
+    else:
+        lat_aux, lon_aux = get_cmsaf_lat_lon(ds_cmsaf, ds_aux)
+        plan = RegridPlan(lat_aux, lon_aux, lat_grid, lon_grid, 'nearest')
+        plan.save(map_path)
+
+    _index_maps[key] = plan
+    return plan
+
+
+def regrid_cmsaf_variables(ds_cmsaf, variables, regrid_plan):
+    """
+    Regrid the first timestamp of several variables of a CLAAS3 product with one gather.
+
+    :param ds_cmsaf: xarray.Dataset of the CLAAS3 product (or of several merged products on the same grid).
+    :param variables: List of the variables to regrid (the ones missing in the dataset are skipped).
+    :param regrid_plan: RegridPlan from get_cmsaf_regrid_plan.
+    :return: Dictionary with the regridded 2D array of each variable.
+    """
+    variables = [var for var in variables if var in ds_cmsaf]
+    if not variables:
+        return {}
+
+    data = np.stack([ds_cmsaf[var].values[0, :, :] for var in variables])
+    regridded = regrid_plan.apply(data).reshape((len(variables),) + regrid_plan.new_shape)
+    return dict(zip(variables, regridded))
@@ -4,7 +4,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import PIL
-from scipy.ndimage import binary_closing
+import sys
+
+#import own methods (from the root of the repository)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cmsaf.closing_functions import stack_binary_closing
 
 
 def crops_nc_fixed(ds_image, x_pixel, y_pixel, crop_positions, filename, out_path, file_type = 'nc'):
@@ -419,7 +423,7 @@ def convert_crops_to_images_1band(ds_image, x_pixel, y_pixel, filename, format,
 
 def apply_cma_mask(ds_day, ds_day_var, value_max):
     """
-    Applies binary closing to each time slice of the 'cma' field in ds_day,
+    Applies binary closing to all the time slices of the 'cma' field in ds_day at once,
     and updates 'ir_108' in ds_day_var accordingly at each timestamp.
 
     Parameters:
@@ -432,16 +436,11 @@ def apply_cma_mask(ds_day, ds_day_var, value_max):
     - Updated ds_day_var with masked 'ir_108' for each time step.
     """
     
-    structure = np.ones((3, 3), dtype=np.uint8)
-
-    for t in ds_day['time']:
-        cma_slice = ds_day['cma'].sel(time=t).values
-        closed_cma = binary_closing(cma_slice, structure=structure)
-
-        ir_108_slice = ds_day_var['IR_108'].sel(time=t)
-        masked_ir_108 = ir_108_slice.where(closed_cma == 1, value_max)
+    # close the cloud mask of all the timestamps in one call (3x3 structure in each time slice)
+    closed_cma = stack_binary_closing(ds_day['cma'].values, 3)
 
-        # Assign updated slice back to dataset
-        ds_day_var['IR_108'].loc[dict(time=t)] = masked_ir_108
+    # Assign the masked slices back to dataset
+    ir_108 = ds_day_var['IR_108'].sel(time=ds_day['time'])
+    ds_day_var['IR_108'].loc[dict(time=ds_day['time'])] = ir_108.where(closed_cma, value_max)
 
     return ds_day_var
\ No newline at end of file
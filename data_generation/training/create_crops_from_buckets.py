@@ -4,15 +4,18 @@ import boto3
 import logging
 from botocore.exceptions import ClientError
 import xarray as xr
-from scipy.ndimage import binary_closing
 import numpy as np
+import sys
+#import own methods (from the root of the repository)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from cmsaf.closing_functions import stack_binary_closing
 
 from cropping_functions import crops_nc_random, crops_nc_fixed, filter_by_domain, filter_by_time
 from credentials_buckets import S3_BUCKET_NAME, S3_ACCESS_KEY, S3_SECRET_ACCESS_KEY, S3_ENDPOINT_URL
 
 def apply_cma_mask(ds_day, ds_day_var, value_max):
     """
-    Applies binary closing to each time slice of the 'cma' field in ds_day,
+    Applies binary closing to all the time slices of the 'cma' field in ds_day at once,
     and updates 'ir_108' in ds_day_var accordingly at each timestamp.
 
     Parameters:
@@ -25,17 +28,12 @@ def apply_cma_mask(ds_day, ds_day_var, value_max):
     - Updated ds_day_var with masked 'ir_108' for each time step.
     """
     
-    structure = np.ones((3, 3), dtype=np.uint8)
+    # close the cloud mask of all the timestamps in one call (3x3 structure in each time slice)
+    closed_cma = stack_binary_closing(ds_day['cma'].values, 3)
 
-    for t in ds_day['time']:
-        cma_slice = ds_day['cma'].sel(time=t).values
-        closed_cma = binary_closing(cma_slice, structure=structure)
-
-        ir_108_slice = ds_day_var['IR_108'].sel(time=t)
-        masked_ir_108 = ir_108_slice.where(closed_cma == 1, value_max)
-
-        # Assign updated slice back to dataset
-        ds_day_var['IR_108'].loc[dict(time=t)] = masked_ir_108
+    # Assign the masked slices back to dataset
+    ir_108 = ds_day_var['IR_108'].sel(time=ds_day['time'])
+    ds_day_var['IR_108'].loc[dict(time=ds_day['time'])] = ir_108.where(closed_cma, value_max)
 
     return ds_day_var
 
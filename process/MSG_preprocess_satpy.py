@@ -6,28 +6,44 @@ and convert it to netCDF
 if needed perfrom parallax correction
 and regrid the data in a regular lat-lon grid
 
+This is the preprocessing engine for both the full disk scan (15 min)
+and the rapid scan service (5 min), selected with scan_mode in config_satpy_process.py.
+MSGrapidscan_preprocess_satpy.py runs it in rapid scan mode.
+
 @author: Daniele Corradini
 
 TODO: check for missing timestamps once the daily dataset has been created
 TODO: better handle inizialization of dataset for native grid 
 """
 import satpy 
+import dask
+from pyresample.geometry import AreaDefinition
 from glob import glob
 import xarray as xr
+import netCDF4
 from datetime import datetime, timedelta
 import os
 import time
 import numpy as np
 import warnings
+from functools import partial
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 
 
 #Import parameters from config file and custom methods
 from config_satpy_process import path_to_file, path_to_cth, natfile, cth_file, path_to_save
-from config_satpy_process import lonmin, lonmax, latmax, latmin, channels, step_deg, interp_method
-from config_satpy_process import parallax_correction, regular_grid, msg_res
+from config_satpy_process import lonmin, lonmax, latmax, latmin, channels, step_deg, interp_method, regrid_cache_dir, regrid_backend
+from config_satpy_process import parallax_correction, regular_grid, scan_mode, scan_modes, fill_engine
 from config_satpy_process import msg_reader, cth_reader
-from config_satpy_process import year, month
-from regrid_functions import regrid_data, fill_missing_data_with_interpolation, generate_regular_grid
+from config_satpy_process import year, month, n_workers, resume, interpolate_cth
+from config_satpy_process import nc_chunk_sizes, nc_compression
+from config_satpy_process import static_geometry_dir
+from regrid_functions import fill_missing_data_with_interpolation, generate_regular_grid, get_regrid_plan
+from run_manifest import SlotRecord, write_manifest_record, new_run_id
+from timestamp_functions import TimestampIndex
+from cth_provider import CTHProvider, parallax_correct_datasets
+from static_geometry import StaticGeometry, get_static_geometry
 
 # get path of this file
 dir_path = os.path.dirname(os.path.abspath(__file__))
@@ -60,6 +76,20 @@ def compute_timestamps_from_time_range(start_date, end_date, time_interval=15):
         
         return timestamps
     
+def compute_month_range(year, month):
+    """
+    Compute the first day of the month and the first day of the following month,
+    in the format used by compute_timestamps_from_time_range (the end date is excluded).
+    """
+    begin_date = f"{year}.{month:02d}.01"
+    if month == 12:
+        end_date = f"{year+1}.01.01"
+    else:
+        end_date = f"{year}.{month+1:02d}.01"
+
+    return begin_date, end_date
+
+    
 def check_filelist(filelist1, filelist2, name1, name2):
     """
     chck if the number of files in 2 filelists are the same
@@ -119,28 +149,67 @@ def extract_timestamps(filenames, type, msg_res=15):
     return timestamps
 
 
-def filter_timestamps(timestamps, base_directory):
+def read_timestamps_status(proj_file_path, filename):
+    """
+    Reads the time coordinate of an existing daily file and checks which timestamps contain valid data.
+    Missing or corrupted timestamps are saved as NaN-filled channels, so a timestamp is considered
+    complete only if every channel has at least one valid value.
+    If the file cannot be read it is renamed with the '.corrupted' extension, so that it can be rewritten.
+
+    Args:
+    proj_file_path (str): The directory path of the daily file.
+    filename (str): The name of the daily file.
+
+    Returns:
+    A dictionary mapping each timestamp in the file to True if it is complete, False otherwise.
+    Empty if the file does not exist.
     """
-    Filters out timestamps that fall on dates for which data has already been converted.
+    if not check_file_exists(proj_file_path, filename):
+        return {}
+
+    file_path = os.path.join(proj_file_path, filename)
+    try:
+        with xr.open_dataset(file_path) as ds_day:
+            complete = np.ones(ds_day.sizes['time'], dtype=bool)
+            for channel in channels:
+                spatial_dims = [dim for dim in ds_day[channel].dims if dim != 'time']
+                complete &= ds_day[channel].notnull().any(dim=spatial_dims).values
+            file_timestamps = ds_day['time'].values.astype('datetime64[s]').tolist()
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        print(f'corrupted file {file_path} ({type(e).__name__}), it will be reprocessed')
+        os.replace(file_path, file_path+'.corrupted')
+        return {}
+
+    return dict(zip(file_timestamps, complete.tolist()))
+
+
+def filter_timestamps(timestamps, base_directory, parallax_correction, available=None):
+    """
+    Filters out timestamps that have already been converted with valid data.
     
     Args:
     timestamps: A list of timestamps to check.
     base_directory: The base directory where the converted files are stored.
+    parallax_correction: Flag used to select the subfolder of the converted files.
+    available: Optional list of booleans, True if the input files of the timestamp exist.
+               Timestamps already saved as missing are kept only if their input files are available now.
     
     Returns:
-    A list of timestamps that are not on dates with converted files.
+    A list of timestamps that are not yet converted or were saved as missing or corrupted.
     """
+    status_by_file = {}
+    clean_timestamps = []
 
-    date = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ').date()
-    year, month, day = date.year, date.month, date.day
+    for t, timestamp in enumerate(timestamps):
+        proj_file_path, filename = get_filename_and_path(timestamp, parallax_correction, base_directory)
+        if filename not in status_by_file:
+            # read each daily file only once
+            status_by_file[filename] = read_timestamps_status(proj_file_path, filename)
+        status = status_by_file[filename]
 
-    filename = f'{year:04d}{month:02d}{day:02d}-EXPATS-RG.nc'
-    file_path = os.path.join(base_directory, str(year), f'{month:02d}', filename)
-    
-    clean_timestamps = []
-    
-    for timestamp in timestamps:
-        if not os.path.isfile(file_path):
+        if timestamp not in status:
+            clean_timestamps.append(timestamp)
+        elif not status[timestamp] and (available is None or available[t]):
             clean_timestamps.append(timestamp)
     
     return clean_timestamps
@@ -149,11 +218,120 @@ def filter_timestamps(timestamps, base_directory):
 def get_channel(channels, idx, parallax):
     ch = channels[idx]
     if parallax:
-        ch = 'parallax_corrected_'+channels[ch_idx]
+        ch = 'parallax_corrected_'+ch
 
     return ch
 
 
+# lat/lon of the crop areas already used in this process, keyed by area
+_area_lonlats = {}
+
+def get_area_lonlats(area):
+    """
+    Returns the longitudes and latitudes of an area definition, computing them only
+    the first time the area is used (the crop area is the same for all the timestamps).
+
+    Parameters:
+    area (pyresample.geometry.AreaDefinition): Area of the cropped Scene.
+
+    Returns:
+    tuple: Longitudes and latitudes (2D arrays).
+    """
+    if area not in _area_lonlats:
+        _area_lonlats[area] = area.get_lonlats()
+    return _area_lonlats[area]
+
+
+# crop slices of the areas already used in this process, keyed by area and bounding box
+_crop_slices = {}
+
+def get_crop_slices(area, ll_bbox):
+    """
+    Returns the row and column slices of an area covering a lon/lat bounding box, computing them
+    only the first time the area is used (the SEVIRI area is the same for thousands of timestamps).
+    The slices are the same computed by satpy.Scene.crop.
+
+    Parameters:
+    area (pyresample.geometry.AreaDefinition): Area of the Scene datasets.
+    ll_bbox (tuple): Bounding box (lonmin, latmin, lonmax, latmax) in degrees.
+
+    Returns:
+    tuple: Row (y) and column (x) slices.
+    """
+    key = (area, tuple(ll_bbox))
+    if key not in _crop_slices:
+        bbox_area = AreaDefinition("crop_area", "crop_area", "crop_latlong", {"proj": "latlong"}, 100, 100, ll_bbox)
+        x_slice, y_slice = area.get_area_slices(bbox_area)
+        _crop_slices[key] = (y_slice, x_slice)
+    return _crop_slices[key]
+
+
+def crop_scene(scn, names, ll_bbox):
+    """
+    Crops a Scene to a lon/lat bounding box as satpy.Scene.crop does, but reusing the crop slices
+    of the area. If the datasets are not all on the same area, the Scene is cropped by Satpy.
+
+    Parameters:
+    scn (satpy.Scene): Scene with the loaded datasets.
+    names (list of str): Names of the loaded datasets.
+    ll_bbox (tuple): Bounding box (lonmin, latmin, lonmax, latmax) in degrees.
+
+    Returns:
+    satpy.Scene: Cropped Scene.
+    """
+    if not scn.all_same_area:
+        return scn.crop(ll_bbox=ll_bbox)
+
+    y_slice, x_slice = get_crop_slices(scn[names[0]].attrs['area'], ll_bbox)
+    return scn.slice((y_slice, x_slice))
+
+
+def load_and_crop_channels(scn, channels, parallax, slot_record=None, cth=None):
+    """
+    Loads all the channels in a single Satpy load call, crops the Scene once to the area of
+    interest and computes all the cropped channels in one dask graph, so that each file
+    is read only once.
+
+    Parameters:
+    scn (satpy.Scene): Scene opened with open_satpy_scene.
+    channels (list of str): Names of the channels to load.
+    parallax (bool): If True, the parallax corrected version of each channel is loaded.
+    slot_record (SlotRecord, optional): If given, the time of the load, crop and compute stages is recorded.
+    cth (xarray.DataArray, optional): Cloud top height in memory (e.g. from CTHProvider) used for the
+                                      parallax correction, instead of the CTH file opened in the Scene.
+
+    Returns:
+    tuple: Latitudes and longitudes of the cropped area (2D arrays) and the list
+           of the cropped data arrays, one per channel in the same order as channels.
+    """
+    names = [get_channel(channels, ch_idx, parallax) for ch_idx in range(len(channels))]
+    stage = slot_record.stage if slot_record else lambda name: nullcontext()
+
+    #Load all the channels at once
+    with stage('load'):
+        if parallax and cth is not None:
+            #correct the channels with the cloud top height in memory
+            scn.load(channels)
+            for corrected in parallax_correct_datasets([scn[ch] for ch in channels], cth):
+                scn[corrected.attrs['name']] = corrected
+        else:
+            scn.load(names)
+
+    #Crop to area of interest
+    with stage('crop'):
+        crop_scn = crop_scene(scn, names, (lonmin, latmin, lonmax, latmax))
+
+        #get the lat/lon coords only for one channel (as all of them share the same grid)
+        area_crop = crop_scn[names[0]].attrs['area'] #area in m
+        sat_lon_crop, sat_lat_crop = get_area_lonlats(area_crop)
+
+    #compute all the channels together, sharing the reading of the file
+    with stage('compute'):
+        sat_data_channels = dask.compute(*[crop_scn[name].data for name in names]) #R/Tb
+
+    return sat_lat_crop, sat_lon_crop, list(sat_data_channels)
+
+
 def find_all_indices(lst, value):
     """
     Returns a list of all indices of value in lst.
@@ -185,26 +363,37 @@ def find_highest_index(lst, value):
     else:
         raise ValueError
 
-def find_common_timestamp_position(timestamp, list1, list2):
+def find_common_timestamp_position(timestamp, msg_index, cth_index, scan_mode='fd', cth_tolerance=timedelta(0)):
     """
-    Checks if a given timestamp is present in both provided lists and returns the highest positions
-    in each list if found. If the timestamp is not found in either list, returns None.
+    Checks if a given timestamp is present in both provided indexes and returns the highest positions
+    in each list if found. If the timestamp is not found in either index, returns None.
+    In rapid scan mode the CTH files are less frequent than the MSG files, so the positions of the
+    CTH files at the start and end of the CTH slot containing the timestamp are returned.
 
     Args:
     timestamp: The timestamp to search for.
-    list1: First list of timestamps.
-    list2: Second list of timestamps.
+    msg_index: TimestampIndex of the MSG timestamps.
+    cth_index: TimestampIndex of the CTH timestamps.
+    scan_mode: 'fd' (full disk) or 'rss' (rapid scan), see scan_modes in config_satpy_process.py.
+    cth_tolerance: Maximum time difference (timedelta) between the timestamp and the closest CTH timestamp,
+                   used when MSG and CTH have the same time resolution.
 
     Returns:
-    A tuple containing the highest positions in list1 and list2, or None if not found in both.
+    A tuple containing the highest positions in the MSG and CTH lists (MSG, previous CTH and
+    following CTH if the CTH resolution is coarser), or None if not found in both.
     """
-    try:
-        pos1 = find_highest_index(list1, timestamp)  # Find the highest index in list1
-        pos2 = find_highest_index(list2, timestamp)  # Find the highest index in list2
-        return (pos1, pos2)
-    except ValueError:
-        # This block is executed if the timestamp is not found in either list
+    pos_msg = msg_index.find(timestamp)
+    if pos_msg is None:
         return None
+
+    cth_res = scan_modes[scan_mode]['cth_res']
+    if cth_res == scan_modes[scan_mode]['msg_res']:
+        pos_cth = cth_index.find_nearest(timestamp, cth_tolerance)
+        return None if pos_cth is None else (pos_msg, pos_cth)
+
+    # previous and following cth timestamps (the same if already on a cth_res interval)
+    pos_cth = cth_index.find_bracketing(timestamp, cth_res)
+    return None if pos_cth is None else (pos_msg,) + pos_cth
     
 
 def open_satpy_scene(file_msg, file_cth, msg_reader, cth_reader, parallax):
@@ -235,7 +424,37 @@ def open_satpy_scene(file_msg, file_cth, msg_reader, cth_reader, parallax):
     return scn
 
 
-def compress_and_save(ds, proj_file_path, filename_save):
+def get_nc_encoding(dims, sizes, chunk_sizes=None, compression=None):
+    """
+    Chunking and compression settings of a time dependent variable, as keyword arguments
+    of netCDF4.Dataset.createVariable (also valid as xarray encoding with the netCDF4 engine).
+
+    Parameters:
+    dims (tuple of str): Dimensions of the variable.
+    sizes (dict): Size of each dimension.
+    chunk_sizes (dict): Chunk size along each dimension, e.g. {'time': 1, 'lat': 128, 'lon': 128}.
+                        Dimensions not given (or None) are not split. Defaults to one chunk per timestamp.
+    compression (dict): Compression settings, e.g. {'zlib': True, 'complevel': 4, 'shuffle': True}
+                        or {'compression': 'zstd', 'complevel': 3} if the netCDF library supports it.
+                        Defaults to zlib with compression level 9.
+
+    Returns:
+    dict: Encoding of the variable.
+    """
+    chunk_sizes = chunk_sizes or {'time': 1}
+    compression = compression or {'zlib': True, 'complevel': 9}
+
+    chunks = []
+    for dim in dims:
+        size = sizes[dim] if dim != 'time' else 1
+        chunks.append(min(chunk_sizes.get(dim) or size, max(sizes[dim], 1)))
+
+    encoding = dict(compression)
+    encoding['chunksizes'] = tuple(chunks)
+    return encoding
+
+
+def compress_and_save(ds, proj_file_path, filename_save, chunk_sizes=None, compression=None):
     """
     Compresses and saves an xarray dataset in the netCDF format with specified compression settings.
 
@@ -245,6 +464,8 @@ def compress_and_save(ds, proj_file_path, filename_save):
                           does not exist, it will be created.
     filename (str): The base name for the output file. The output filename will be derived from this,
                     removing any directory path and changing the extension to '.nc'.
+    chunk_sizes (dict): Chunk size along each dimension, see get_nc_encoding.
+    compression (dict): Compression settings, see get_nc_encoding.
     """
 
     # Check if the directory exists
@@ -255,16 +476,156 @@ def compress_and_save(ds, proj_file_path, filename_save):
     #save the features using a similar name of the HDF5 file but in netCDF format
     #ds.to_netcdf(proj_file_path+filename_save)
     encoding_dict = {}
-    for channel in channels:
-        encoding_dict[channel] = {"zlib": True, "complevel": 9}
+    for name, var in ds.data_vars.items():
+        if 'time' in var.dims:
+            encoding_dict[name] = get_nc_encoding(var.dims, ds.sizes, chunk_sizes, compression)
     encoding_dict['time'] = {"units": "seconds since 2000-01-01", "dtype": "i4"}
 
     # Save the dataset with specified compression settings
+    # (time is unlimited so that DailyNetCDFWriter can append to the file later)
     ds.to_netcdf(proj_file_path+filename_save, \
-        encoding=encoding_dict)
+        encoding=encoding_dict, unlimited_dims=['time'])
     print('product saved\n')
 
 
+class DailyNetCDFWriter:
+    """
+    Incremental writer for the daily netCDF file. Each timestamp is written to the file
+    along the unlimited 'time' dimension as soon as it is processed, so only one timestamp
+    is kept in memory and the timestamps already written are kept on disk if the run crashes.
+    Chunking, compression and time encoding are the same used by compress_and_save.
+    All the data variables of a timestamp are written along 'time', also the ones without a 'time'
+    dimension (e.g. the channels of process_timestamp, on (lat, lon) or (y, x)), as xr.concat does.
+    The coordinates without a 'time' dimension (lat, lon) are written only once.
+    """
+
+    time_units = "seconds since 2000-01-01"
+
+    def __init__(self, proj_file_path, filename_save, chunk_sizes=None, compression=None):
+        """
+        Parameters:
+        proj_file_path (str): The directory path where the netCDF file will be saved. If the directory
+                              does not exist, it will be created.
+        filename_save (str): The name of the daily netCDF file. If the file already exists,
+                             new timestamps are added to it (with the chunking of the existing file).
+                             Files with a fixed 'time' dimension (e.g. written by older versions) or
+                             with timestamps left incomplete by a crash are rewritten first.
+        chunk_sizes (dict): Chunk size along each dimension, see get_nc_encoding.
+        compression (dict): Compression settings, see get_nc_encoding.
+        """
+        os.makedirs(proj_file_path, exist_ok=True)
+        self.path = proj_file_path+filename_save
+        self.chunk_sizes = chunk_sizes
+        self.compression = compression
+        self.nc = None
+        self.time_index = {}
+        self.unsorted = False
+
+        if os.path.exists(self.path):
+            with netCDF4.Dataset(self.path) as nc:
+                unlimited = nc.dimensions['time'].isunlimited()
+                masked_times = np.ma.getmaskarray(nc['time'][:]).any()
+            if not unlimited or masked_times:
+                self._rewrite()
+
+            self.nc = netCDF4.Dataset(self.path, 'a')
+            # map the timestamps already in the file to their position
+            times = self.nc['time'][:]
+            self.time_index = {int(t): i for i, t in enumerate(times) if not np.ma.is_masked(t)}
+
+    def _create(self, ds):
+        """
+        Creates the file using the dimensions, coordinates and variables of the first timestamp.
+        """
+        self.nc = netCDF4.Dataset(self.path, 'w')
+        self.nc.createDimension('time', None)
+
+        time_var = self.nc.createVariable('time', 'i4', ('time',))
+        time_var.units = self.time_units
+        time_var.calendar = 'proleptic_gregorian'
+
+        for name, var in ds.variables.items():
+            if name != 'time':
+                self._create_variable(name, var, ds)
+
+    def _create_variable(self, name, var, ds):
+        """
+        Creates a variable of the file (and its dimensions if missing): the data variables along
+        the time dimension, chunked and compressed as in compress_and_save, the coordinates as static.
+        """
+        time_dependent = name in ds.data_vars or 'time' in var.dims
+        dims = var.dims if 'time' in var.dims or not time_dependent else ('time',) + var.dims
+        for dim in dims:
+            if dim not in self.nc.dimensions:
+                self.nc.createDimension(dim, ds.sizes[dim])
+
+        if time_dependent:
+            sizes = dict(ds.sizes, time=1)
+            encoding = get_nc_encoding(dims, sizes, self.chunk_sizes, self.compression)
+            nc_var = self.nc.createVariable(name, 'f4', dims, fill_value=np.float32(np.nan), **encoding)
+        else:
+            # static coordinates are written only once
+            nc_var = self.nc.createVariable(name, var.dtype, dims)
+            nc_var[:] = var.values
+        nc_var.setncatts({k: v for k, v in var.attrs.items() if isinstance(v, (str, int, float, np.generic))})
+
+    def write(self, ds):
+        """
+        Writes one timestamp to the file. If the timestamp is already in the file it is overwritten,
+        otherwise it is appended along the time dimension.
+
+        Parameters:
+        ds (xarray.Dataset): Dataset of a single timestamp with a singleton 'time' dimension.
+        """
+        if self.nc is None:
+            self._create(ds)
+
+        time_value = int((ds['time'].values[0] - np.datetime64('2000-01-01')) // np.timedelta64(1, 's'))
+        index = self.time_index.get(time_value, len(self.nc.dimensions['time']))
+
+        # timestamps appended before existing ones (e.g. when resuming) are sorted on close
+        if time_value not in self.time_index and self.time_index and time_value < max(self.time_index):
+            self.unsorted = True
+
+        # time first: if the run crashes before the channels are written, the timestamp
+        # is left NaN-filled and it is reprocessed when resuming
+        self.nc['time'][index] = time_value
+        self.time_index[time_value] = index
+        for name, var in ds.data_vars.items():
+            if name not in self.nc.variables:
+                # e.g. the lat/lon grid of the native mode, missing if the first timestamp failed
+                self._create_variable(name, var, ds)
+            values = var.values[0] if 'time' in var.dims else var.values
+            self.nc[name][index] = values.astype(np.float32)
+
+        # flush to disk so that the timestamp is kept even if the run crashes
+        self.nc.sync()
+
+    def close(self):
+        """
+        Closes the netCDF file.
+        """
+        if self.nc is not None:
+            self.nc.close()
+            if self.unsorted:
+                self._rewrite()
+            print(f'product saved in {self.path}\n')
+
+    def _rewrite(self):
+        """
+        Rewrites the file with an unlimited 'time' dimension and the timestamps in time order,
+        dropping the timestamps without a time value.
+        """
+        # rows without a time value (masked by netCDF4, not always decoded as NaT by xarray)
+        with netCDF4.Dataset(self.path) as nc:
+            valid_times = ~np.ma.getmaskarray(nc['time'][:])
+        with xr.open_dataset(self.path) as ds_day:
+            ds_day = ds_day.isel(time=valid_times).sortby('time').load()
+        proj_file_path, filename_save = os.path.split(self.path)
+        compress_and_save(ds_day, proj_file_path+'/', filename_save+'.tmp', self.chunk_sizes, self.compression)
+        os.replace(self.path+'.tmp', self.path)
+
+
 def initialize_empty_dataset(channels, lat_arr, lon_arr, regular_grid):
     """
     Initializes an empty xarray Dataset with specified channels and spatial coordinates,
@@ -357,20 +718,161 @@ def get_filename_and_path(timestamp, parallax_correction, path_to_save):
     return proj_file_path, filename
 
 
+# CTH provider and static geometry of this process, created once per worker process (or once in the
+# main process when running serially) so that they are reused by all the slots of the worker
+_cth_provider = None
+_static_geometry = None
 
-if __name__ == "__main__":
+def init_worker(cth_provider_args=None, static_geometry_path=None):
+    """
+    Initializes a worker process (or the main process when running serially), creating its CTHProvider
+    and memory-mapping the static geometry of the grid.
 
-    # Ignore specific warnings by message
-    warnings.filterwarnings("ignore", message="You will likely lose important projection information when converting to a PROJ string from another format.")
-    warnings.filterwarnings("ignore", message="Overlap checking not implemented. Waiting for fix for https://github.com/pytroll/pyresample/issues/329")
+    Parameters:
+    cth_provider_args (tuple): Arguments of CTHProvider, None if the CTH is not interpolated in memory.
+    static_geometry_path (str): Folder of the static geometry store of the regular grid, None if not used.
+    """
+    global _cth_provider, _static_geometry
+    _cth_provider = CTHProvider(*cth_provider_args) if cth_provider_args else None
+    _static_geometry = StaticGeometry(static_geometry_path) if static_geometry_path else None
 
+
+def process_timestamp(t, timestamp, file_msg, file_cth, lat_arr, lon_arr, cth_provider=None):
+    """
+    Processes a single timestamp: opens the MSG (and CTH) files with Satpy, loads and crops
+    the channels and, if needed, fills the missing data and regrids them to the regular grid.
+    This function runs independently for each timestamp, so it can be used by a pool of workers.
+
+    Parameters:
+    t (int): Position of the timestamp in the list of timestamps of the period (used for logging).
+    timestamp (datetime): Timestamp to process.
+    file_msg (str): Path to the MSG file, None if missing.
+    file_cth (str): Path to the CTH file, None if missing.
+    lat_arr (array-like): Latitude values of the regular grid.
+    lon_arr (array-like): Longitude values of the regular grid.
+    cth_provider (CTHProvider, optional): If given, the parallax correction uses the CTH interpolated
+                                          in memory at the timestamp instead of the CTH file.
+                                          Defaults to the provider of the process, see init_worker.
+
+    Returns:
+    tuple: Dataset of the timestamp with a singleton 'time' dimension, with the channels left NaN-filled
+           if the files are missing or corrupted, and the SlotRecord with the status and stage timings.
+    """
+    print(f'Current timestamp: {timestamp}')
+    slot_record = SlotRecord(t, timestamp)
+    cth_provider = cth_provider or _cth_provider
+
+    if regular_grid:
+        if _static_geometry is not None:
+            # Grid points memory-mapped from the static geometry store
+            lat_reg_grid, lon_reg_grid = _static_geometry['lat'], _static_geometry['lon']
+        else:
+            # Generate grid points
+            lat_reg_grid, lon_reg_grid = np.meshgrid(lat_arr, lon_arr, indexing='ij')
+
+    #create an empty dataset
+    ds = create_dataset_with_lat_lon_dimensions(channels, lat_arr, lon_arr, regular_grid)
+
+    #add timestamp to dataset
+    ds['time'] = [timestamp] 
+
+    if file_msg:
+        try:
+            with slot_record.stage('open'):
+                if parallax_correction and cth_provider is not None:
+                    #the CTH is not read from a file in the Scene but interpolated in memory
+                    scn = open_satpy_scene(file_msg,None,msg_reader,cth_reader,False)
+                    cth = cth_provider.get(timestamp)
+                else:
+                    scn = open_satpy_scene(file_msg,file_cth,msg_reader,cth_reader,parallax_correction)
+                    cth = None
+        
+            #load and crop all the channels at once
+            sat_lat_crop, sat_lon_crop, sat_data_channels = load_and_crop_channels(scn, channels, parallax_correction, slot_record, cth)
+
+            if not regular_grid:
+                # create DataArrays with the coordinates using cloud mask grid
+                lon_da = xr.DataArray(sat_lon_crop.astype(np.float32), dims=("y", "x"), name="lon_grid")
+                lat_da = xr.DataArray(sat_lat_crop.astype(np.float32), dims=("y", "x"), name="lat_grid")
+
+                # combine DataArrays into xarray object
+                ds["lon_grid"] = lon_da
+                ds["lat_grid"] = lat_da
+
+            #stack the channels in a (channel, y, x) cube
+            sat_data_crop = np.stack(sat_data_channels)
+
+            if regular_grid:
+                #interpolate the missing points (NaN) of all the channels at once
+                with slot_record.stage('fill'):
+                    sat_data_crop = fill_missing_data_with_interpolation(sat_lat_crop, sat_lon_crop, sat_data_crop, engine=fill_engine)
+                
+                #regrid all the channels to a regular grid in one pass
+                #(the regridding weights are computed only once for the same crop grid)
+                with slot_record.stage('regrid'):
+                    regrid_plan = get_regrid_plan(sat_lat_crop, sat_lon_crop, lat_reg_grid, lon_reg_grid, interp_method, regrid_cache_dir,
+                                                  regrid_backend)
+                    sat_data_crop = regrid_plan.apply(sat_data_crop)
+
+            for ch_idx in range(len(channels)):
+                if regular_grid:
+                    #add channel values to the Dataarray
+                    sat_da = xr.DataArray(
+                    sat_data_crop[ch_idx].astype(np.float32),
+                    #dims=("y", "x"),
+                    #coords={"lat": ("y", lat_arr.astype(np.float32)), "lon": ("x", lon_arr.astype(np.float32))},
+                    dims=("lat", "lon"),  # Set dimensions to lat and lon
+                    coords={
+                        "lat": (["lat"], lat_arr.astype(np.float32)),  # Define latitude coordinate
+                        "lon": (["lon"], lon_arr.astype(np.float32))   # Define longitude coordinate
+                    },
+                    name=channels[ch_idx]
+                    )
+
+                else:        
+                    sat_da = xr.DataArray(sat_data_crop[ch_idx], dims=("y", "x"), name=channels[ch_idx])
+                
+                #add channel values to the Dataset
+                ds[channels[ch_idx]] = sat_da
+        except Exception as e:
+            #any failure of the slot (truncated file, reader error, ...) skips only this slot,
+            #the type of the exception is kept in the manifest
+            print(f'corrupted timestamps: {t} ({type(e).__name__}: {e})')
+            slot_record.set_status('corrupted', e)
+    else:
+        print(f'missing timestamps: {t}')
+        slot_record.set_status('missing')
+
+    return ds, slot_record
+
+
+def run_preprocessing(year, month, scan_mode=scan_mode, n_workers=n_workers, resume=resume):
+    """
+    Runs the preprocessing of one month of MSG data: matches the MSG and CTH files to the timestamps
+    of the month, processes the timestamps (in parallel if requested) and writes the daily files.
+
+    Parameters:
+    year (int): Year to process.
+    month (int): Month to process.
+    scan_mode (str): 'fd' (full disk, 15 min) or 'rss' (rapid scan, 5 min).
+    n_workers (int): Number of worker processes, 1 to run serially.
+    resume (bool): If True, skip the timestamps already converted in a previous run.
+    """
     # Start time script
     begin_time = time.time()
 
-    #compute timestamps of the period
-    begin_date = f"{year}.{month:02d}.01"
-    end_date = f"{year}.{month+1:02d}.01" #end point is excluded. CAREFUL! this only works for months except december
+    # Path to the JSON-lines manifest with the status and stage timings of each slot
+    # (summarize it with: python run_manifest.py log/manifest_satpy.jsonl)
+    manifest_path = dir_path + '/log/manifest_satpy.jsonl'
+    run_id = new_run_id()
+
+    #time resolution of the MSG files in this scan mode
+    msg_res = scan_modes[scan_mode]['msg_res']
+
+    #compute timestamps of the period (end point is excluded)
+    begin_date, end_date = compute_month_range(year, month)
     timestamps = compute_timestamps_from_time_range(begin_date, end_date, time_interval=msg_res)   
+    timestamps = [timestamp for timestamp in timestamps if timestamp < datetime.strptime(end_date, "%Y.%m.%d")]
     print(f'total number of timestamps in {begin_date}-{end_date}: {len(timestamps)}')
 
     #open all MSG files in directory 
@@ -385,127 +887,106 @@ if __name__ == "__main__":
     msg_timestamps = extract_timestamps(fnames,'msg', msg_res=msg_res)
     cth_timestamps = extract_timestamps(cth_fnames, 'cth')
 
-    #TODO create a function that remore the timestamps of the file already converted
-
     check_filelist(msg_timestamps, cth_timestamps, 'msg_timestamps', 'cth_timestamps')
 
     #find a regular grid
+    lat_arr, lon_arr = None, None
+    static_geometry_path = None
     if regular_grid:
         lat_arr,  lon_arr = generate_regular_grid(latmin,latmax,lonmin,lonmax,step_deg,path_to_file)
-        
-        # Generate grid points
-        lat_reg_grid, lon_reg_grid = np.meshgrid(lat_arr, lon_arr, indexing='ij')
-
-    # initialize day variable
-    last_day = '00'
-    count = 0 
 
-    #Read data at different temporal steps (use cth because complete)
-    for t, timestamp in enumerate(timestamps):
-        # count over the loop
-        print(f'Processing file number {t+1}/{len(timestamps)}')
-        print(f'Current timestamp: {timestamp}')
-
-        #extract day from time string
-        day = timestamp.strftime("%d")
-
-        #create an empty dataset
-        ds = create_dataset_with_lat_lon_dimensions(channels, lat_arr, lon_arr, regular_grid)
+        #static geometry of the grid, built only the first time (each worker memory-maps it)
+        if static_geometry_dir:
+            try:
+                geometry = get_static_geometry(lat_arr, lon_arr, static_geometry_dir)
+                static_geometry_path = geometry.store_path
+            except (OSError, ValueError) as e:
+                print(f'static geometry not available ({type(e).__name__}: {e}), the grid points are computed for each slot')
 
-        #add timestamp to dataset
-        ds['time'] = [timestamp] 
+    #index the timestamps of the files once for fast lookups
+    msg_index = TimestampIndex(msg_timestamps)
+    cth_index = TimestampIndex(cth_timestamps)
 
-        #check if cth and msg exist for the corresponding timestamp
-        positions = find_common_timestamp_position(timestamp,msg_timestamps,cth_timestamps)
-        
+    #check if cth and msg exist for each timestamp
+    files_msg, files_cth = [], []
+    for t, timestamp in enumerate(timestamps):
+        positions = find_common_timestamp_position(timestamp,msg_index,cth_index,scan_mode)
         if positions:
-            file_msg = fnames[positions[0]]
-            #print(file_msg)
-            file_cth = cth_fnames[positions[1]]
-            #print(file_cth)
-            try:
-                scn = open_satpy_scene(file_msg,file_cth,msg_reader,cth_reader,parallax_correction)
-            
-                # loop over the channels 
-                for ch_idx in range(len(channels)):
-                    #Load one channel
-                    ch = get_channel(channels,ch_idx,parallax_correction)
-                    scn.load([ch]) 
-
-                    #Crop to area of interest
-                    crop_scn = scn.crop(ll_bbox=(lonmin, latmin, lonmax, latmax))
-
-                    #get the lat/lon coordsonly for one channel (as all of them share the same grid)
-                    if ch_idx==0:
-                        #get coord in the cropped area
-                        area_crop = crop_scn[ch].attrs['area'] #area in m
-                        sat_lon_crop, sat_lat_crop = area_crop.get_lonlats() 
-                        #print(np.shape(sat_lat_crop),sat_lat_crop)
-                        #print(np.shape(sat_lon_crop),sat_lon_crop)
-
-                        if not regular_grid:
-                            # create DataArrays with the coordinates using cloud mask grid
-                            lon_da = xr.DataArray(sat_lon_crop.astype(np.float32), dims=("y", "x"), name="lon_grid")
-                            lat_da = xr.DataArray(sat_lat_crop.astype(np.float32), dims=("y", "x"), name="lat_grid")
-
-                            # combine DataArrays into xarray object
-                            ds["lon_grid"] = lon_da
-                            ds["lat_grid"] = lat_da
-                            #print(ds)
-
-                    #get data in the cropped area
-                    sat_data_crop = crop_scn[ch].values #R/Tb
-                    #print('sat data',sat_data_crop)
-
-                    if regular_grid:
-                        #interpolate the missing points (NaN)
-                        sat_data_crop = fill_missing_data_with_interpolation(sat_lat_crop, sat_lon_crop, sat_data_crop)
-                        
-                        #regrid the sat data to a regular grid
-                        sat_data_crop = regrid_data(sat_lat_crop, sat_lon_crop, sat_data_crop, lat_reg_grid, lon_reg_grid, interp_method) 
-                        
-                        #add channel values to the Dataarray
-                        sat_da = xr.DataArray(
-                        sat_data_crop.astype(np.float32),
-                        #dims=("y", "x"),
-                        #coords={"lat": ("y", lat_arr.astype(np.float32)), "lon": ("x", lon_arr.astype(np.float32))},
-                        dims=("lat", "lon"),  # Set dimensions to lat and lon
-                        coords={
-                            "lat": (["lat"], lat_arr.astype(np.float32)),  # Define latitude coordinate
-                            "lon": (["lon"], lon_arr.astype(np.float32))   # Define longitude coordinate
-                        },
-                        name=channels[ch_idx]
-                        )
-
-                    else:        
-                        sat_da = xr.DataArray(sat_data_crop, dims=("y", "x"), name=channels[ch_idx])
-                    
-                    #add channel values to the Dataset
-                    ds[channels[ch_idx]] = sat_da
-            except:
-                print(f'corrupted timestamps: {t}')
-        else:
-            print(f'missing timestamps: {t}')      
-        
-        if day == last_day:
-            ds_day = xr.concat([ds_day, ds], dim='time')
+            files_msg.append(fnames[positions[0]])
+            files_cth.append(cth_fnames[positions[1]])
         else:
-            if count>0:
-                #save the daily dataset 
-                proj_file_path, filename = get_filename_and_path(timestamps[t-1],parallax_correction,path_to_save)
-                print(filename)
-                compress_and_save(ds_day,proj_file_path,filename)
-                #update dataset with the next day
-            ds_day = ds
-        count+=1
-            
-
-        #print(ds_day)
-        #update last day
-        last_day = day   
+            files_msg.append(None)
+            files_cth.append(None)
+
+    #skip the timestamps already converted in a previous run
+    todo = list(range(len(timestamps)))
+    if resume:
+        available = [file_msg is not None for file_msg in files_msg]
+        pending = set(filter_timestamps(timestamps, path_to_save, parallax_correction, available))
+        todo = [t for t in todo if timestamps[t] in pending]
+        print(f'resuming: {len(todo)}/{len(timestamps)} timestamps left to process')
+
+    #interpolate the CTH in memory at the MSG timestamps between two CTH files (rapid scan)
+    #(the provider is created once in each worker, not sent with every slot)
+    cth_provider_args = None
+    slots_per_cth = 1
+    if parallax_correction and interpolate_cth and scan_modes[scan_mode]['cth_res'] != msg_res:
+        cth_provider_args = (cth_fnames, cth_timestamps, cth_reader, scan_modes[scan_mode]['cth_res'])
+        slots_per_cth = max(scan_modes[scan_mode]['cth_res'] // msg_res, 1)
+
+    #process the timestamps, fanning them out to a pool of workers if requested
+    process_slot = partial(process_timestamp, lat_arr=lat_arr, lon_arr=lon_arr)
+    todo_args = (todo, [timestamps[t] for t in todo], [files_msg[t] for t in todo], [files_cth[t] for t in todo])
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                                       initargs=(cth_provider_args, static_geometry_path))
+        #consecutive slots between the same CTH files go to the same worker
+        slots = executor.map(process_slot, *todo_args, chunksize=slots_per_cth)
+    else:
+        init_worker(cth_provider_args, static_geometry_path)
+        slots = map(process_slot, *todo_args)
+
+    #collect the processed timestamps in time order and write them to the daily files as they finish
+    writer = None
+    try:
+        for t, (ds, slot_record) in zip(todo, slots):
+            # count over the loop
+            print(f'Processed file number {t+1}/{len(timestamps)}')
+
+            #open the writer of a new daily file when the day changes
+            proj_file_path, filename = get_filename_and_path(timestamps[t],parallax_correction,path_to_save)
+            if writer is None or writer.path != proj_file_path+filename:
+                if writer is not None:
+                    writer.close()
+                writer = DailyNetCDFWriter(proj_file_path, filename, nc_chunk_sizes, nc_compression)
+
+            with slot_record.stage('write'):
+                writer.write(ds)
+
+            #keep track of the status and timing of the slot
+            write_manifest_record(manifest_path, slot_record, run_id)
+    finally:
+        #close the file of the last day of the period (also if the run is interrupted,
+        #so the timestamps already written stay readable and can be resumed)
+        if writer is not None:
+            writer.close()
+
+        if n_workers > 1:
+            executor.shutdown(cancel_futures=True)
     
     print('Processing concluded!')
 
+    return begin_time
+
+
+if __name__ == "__main__":
+
+    # Ignore specific warnings by message
+    warnings.filterwarnings("ignore", message="You will likely lose important projection information when converting to a PROJ string from another format.")
+    warnings.filterwarnings("ignore", message="Overlap checking not implemented. Waiting for fix for https://github.com/pytroll/pyresample/issues/329")
+
+    begin_time = run_preprocessing(year, month, scan_mode)
+
     # End time
     end_time = time.time()
 
@@ -516,4 +997,4 @@ if __name__ == "__main__":
 
     # Write elapsed time to the file
     with open(output_file_path, 'w') as file:
-        print(f"Elapsed time: {elapsed_time} seconds", file=file)
\ No newline at end of file
+        print(f"Elapsed time: {elapsed_time} seconds", file=file)
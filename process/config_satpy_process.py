@@ -37,16 +37,63 @@ regular_grid = True
 step_deg = 0.04 #correspond to around 3-4 km the actual resolution of MSG
 interp_method = 'nearest'
 
+#gap filling of the missing pixels before regridding: 'griddata' (lat/lon triangulation) or 'grid' (neighbours in the image,
+#faster, but it differs from griddata by up to ~3 K on 2D gaps and it also fills the pixels at the border of the crop)
+fill_engine = 'griddata'
+
+#path to the folder to cache the regridding plans (weights from the SEVIRI crop to the regular grid)
+regrid_cache_dir = "/data/sat/msg/regrid_plans/"
+
+#library computing the regridding weights: 'scipy' (same results as griddata) or 'pyresample' (bilinear/nearest to an
+#area definition of the grid; its nearest neighbour differs from griddata on ~1% of the pixels, by up to ~2 K, see RegridPlan.from_pyresample)
+regrid_backend = 'scipy'
+
+#path to the folder of the static geometry of the grid (2D lat/lon), see static_geometry.py
+#(the preprocessing takes the coordinates of the regular grid from it, None to not use it)
+static_geometry_dir = "/data/sat/msg/static_geometry/"
+
+#regridded DEM written by process_orography.py
+dem_path = "/data/sat/msg/orography/DEM_EXPATS_0.01x0.01.nc"
+
+#chunking of the daily netCDF files: one timestamp and tiles of 128x128 pixels per chunk, so that
+#the readers of a single channel or of a small crop decompress only the tiles they need (see readers/daily_nc.py)
+nc_chunk_sizes = {'time': 1, 'lat': 128, 'lon': 128}
+
+#compression of the daily netCDF files, e.g. {'zlib': True, 'complevel': 9} for the smallest files
+#or {'compression': 'zstd', 'complevel': 3} for faster (de)compression if the netCDF library supports it
+nc_compression = {'zlib': True, 'complevel': 4, 'shuffle': True}
+
+# SEVIRI scan mode: 'fd' full disk scan (every 15 min) or 'rss' rapid scan service (every 5 min)
+scan_mode = 'rss'
+
+# time resolution (in minutes) of the MSG and CTH files for each scan mode
+# and longitude of the sub-satellite point (degrees)
+scan_modes = {'fd': {'msg_res': 15, 'cth_res': 15, 'sub_lon': 0.0},
+              'rss': {'msg_res': 5, 'cth_res': 15, 'sub_lon': 9.5}}
+
 # MSG time resolution
-msg_res = 5
+msg_res = scan_modes[scan_mode]['msg_res']
 
 # cth time resolution
-cth_res = 15
+cth_res = scan_modes[scan_mode]['cth_res']
+
+# longitude of the sub-satellite point
+sub_lon = scan_modes[scan_mode]['sub_lon']
+
+# Flag to interpolate in memory the CTH used for the parallax correction at the MSG timestamps
+# between two CTH files (rapid scan), otherwise the previous CTH file is used
+interpolate_cth = True
 
 #Satpy reader for MSG data and cth
 msg_reader = 'seviri_l1b_native'
 cth_reader = "cmsaf-claas3_l2_nc" #"nwcsaf-geo" 
 
+# number of worker processes used to process the timestamps in parallel (1 to run serially)
+n_workers = 1
+
+# resume a previous run: skip the timestamps already saved with valid data in path_to_save
+resume = False
+
 # settings for study period
 year = 2022
 month = 9 #use "*" if all months considered
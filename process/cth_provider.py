@@ -0,0 +1,122 @@
+"""
+This module provides the cloud top height (CTH) needed by the parallax correction
+at any MSG timestamp, without an interpolated CTH archive on disk.
+The CM SAF CTX files are read with Satpy only when needed and the decoded fields
+are kept in a small LRU cache. At timestamps between two CTX files (e.g. MSG rapid
+scan every 5 min, CTH every 15 min) the CTH is interpolated linearly in memory.
+The parallax correction is then applied to the loaded channels with the Satpy
+parallax correction, computing the corrected area only once for all the channels.
+
+@author: Daniele Corradini
+"""
+
+from collections import OrderedDict
+import numpy as np
+import satpy
+from satpy.modifiers.parallax import ParallaxCorrection
+
+try:
+    from satpy.resample.base import resample_dataset
+except ImportError:
+    #older Satpy versions
+    from satpy.resample import resample_dataset
+
+from timestamp_functions import TimestampIndex
+
+
+class CTHProvider:
+    """
+    Cloud top height at a given time, read from the CTX files and interpolated in time if needed.
+    """
+
+    def __init__(self, cth_files, cth_timestamps, cth_reader, cth_res, var='ctth_alti', cache_size=4):
+        """
+        :param cth_files: List of paths to the CTX files.
+        :param cth_timestamps: List of the timestamps of the CTX files (e.g. from extract_timestamps).
+        :param cth_reader: Satpy reader of the CTX files.
+        :param cth_res: Time resolution of the CTX files in minutes.
+        :param var: Name of the cloud top height dataset.
+        :param cache_size: Number of decoded CTX fields kept in memory.
+        """
+        self.cth_files = cth_files
+        self.index = TimestampIndex(cth_timestamps)
+        self.cth_reader = cth_reader
+        self.cth_res = cth_res
+        self.var = var
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def read(self, pos):
+        """
+        Decoded cloud top height of a CTX file, from the cache if available.
+
+        :param pos: Position of the file in the list of CTX files.
+        :return: xarray.DataArray with the area and orbital parameters of the file.
+        """
+        if pos in self.cache:
+            self.cache.move_to_end(pos)
+            return self.cache[pos]
+
+        scn = satpy.Scene(reader=self.cth_reader, filenames=[self.cth_files[pos]])
+        scn.load([self.var])
+        cth = scn[self.var].compute()
+
+        self.cache[pos] = cth
+        if len(self.cache) > self.cache_size:
+            # drop the least recently used field
+            self.cache.popitem(last=False)
+        return cth
+
+    def get(self, timestamp):
+        """
+        Cloud top height at the given time. Between two CTX files the height is interpolated
+        linearly, pixels cloudy only in one of the two files take the value (height or clear sky)
+        of the file closest in time.
+
+        :param timestamp: datetime of the MSG slot.
+        :return: xarray.DataArray of the cloud top height, or None if the CTX files around the timestamp are missing.
+        """
+        positions = self.index.find_bracketing(timestamp, self.cth_res)
+        if positions is None:
+            return None
+
+        pos_before, pos_after = positions
+        before = self.read(pos_before)
+        if pos_before == pos_after:
+            return before
+        after = self.read(pos_after)
+
+        # fraction of the CTH interval between the previous file and the timestamp
+        weight = (timestamp.minute % self.cth_res + timestamp.second / 60) / self.cth_res
+        values = before.values + (after.values - before.values) * weight
+        nearest = before.values if weight <= 0.5 else after.values
+        values = np.where(np.isnan(values), nearest, values)
+
+        cth = before.copy(data=values)
+        cth.attrs['start_time'] = timestamp
+        cth.attrs['end_time'] = timestamp
+        return cth
+
+
+def parallax_correct_datasets(datasets, cth, radius_of_influence=50000):
+    """
+    Apply the parallax correction to datasets sharing the same area, as the Satpy
+    ParallaxCorrectionModifier does, but computing the corrected area only once.
+
+    :param datasets: List of xarray.DataArray loaded with Satpy, on the same area.
+    :param cth: Cloud top height (xarray.DataArray with area and orbital parameters), e.g. from CTHProvider.get.
+    :param radius_of_influence: Radius in meters used to resample the CTH and the datasets.
+    :return: List of the parallax corrected xarray.DataArray, on the original area.
+    """
+    base_area = datasets[0].attrs['area']
+    corrector = ParallaxCorrection(base_area)
+    plax_corr_area = corrector(cth, cth_radius_of_influence=radius_of_influence)
+
+    corrected = []
+    for dataset in datasets:
+        res = resample_dataset(dataset, plax_corr_area, radius_of_influence=radius_of_influence, fill_value=np.nan)
+        res.attrs = dict(dataset.attrs)
+        res.attrs['name'] = 'parallax_corrected_' + dataset.attrs['name']
+        corrected.append(res)
+
+    return corrected
@@ -1,15 +1,11 @@
 """
-Open MSG-SEVIRI files with Satpy 
-Crop it to area of interest, 
-project it in latlon grid 
-and convert it to netCDF
-if needed perfrom parallax correction
-and regrid the data in a regular lat-lon grid
+Interpolate the CM SAF CTH files (every 15 min) in time
+to the resolution of the MSG rapid scan (every 5 min).
+The CTH files are read one at a time and only the previous field
+is kept in memory, the in-between timestamps are computed directly
+from the two fields and written to one time-indexed file per month.
 
 @author: Daniele Corradini
-
-TODO: check for missing timestamps once the daily dataset has been created
-TODO: better handle inizialization of dataset for native grid 
 """
 # %%
 from glob import glob
@@ -18,18 +14,16 @@ from datetime import datetime, timedelta
 import os
 import time
 import numpy as np
-import warnings
-import matplotlib.pyplot as plt
 import pandas as pd
 
 
 #Import parameters from config file and custom methods
-from MSG_preprocess_satpy import get_datetime_cth, compute_timestamps_from_time_range
+from MSG_preprocess_satpy import get_datetime_cth, compute_timestamps_from_time_range, DailyNetCDFWriter
 from config_satpy_process import path_to_file, path_to_cth, natfile, cth_file, path_to_save
 from config_satpy_process import lonmin, lonmax, latmax, latmin, channels, step_deg, interp_method
 from config_satpy_process import parallax_correction, regular_grid, msg_res, cth_res
 from config_satpy_process import msg_reader, cth_reader
-from config_satpy_process import year, month
+from config_satpy_process import year, month, nc_chunk_sizes, nc_compression
 from regrid_functions import regrid_data, fill_missing_data_with_interpolation, generate_regular_grid
 
 # get path of this file
@@ -49,10 +43,15 @@ end_date=f"{year}.06.06" # <<<<<<<<<<<<<<<<<<< (excluding)
 interpol_res = 5
 interpol_method = "linear"
 output_folder = f"{path_to_cth[:-1]}_interpolated_{interpol_res}min"
-os.makedirs(output_folder, exist_ok=True)
 
 def generate_interpolated_CTH_timestamps(year, start_date, end_date, output_folder, interpol_res=5, interpol_method='linear'):
+    """
+    Get the CTH files of the period, including the first file of the end date
+    to interpolate the last timestamps of the period.
 
+    Returns:
+    list: Sorted paths of the CTH files.
+    """
     # get all cth timestamps in this period
     timestamps = compute_timestamps_from_time_range(start_date, end_date)
     print(len(timestamps), timestamps[0], timestamps[-1])
@@ -68,124 +67,128 @@ def generate_interpolated_CTH_timestamps(year, start_date, end_date, output_fold
         # check if last unique day (end of period)
         if day == unique_days[-1]:
             # write only first file to list
-            cth_files.extend([day_files[0]])
+            cth_files.extend(day_files[:1])
         else:
             # write to list
             cth_files.extend(day_files)
-    
-def get_filename_for_interpolated_timestamps(cth_file, time_step, time_interval=5, interpol='linear'):
-    # get filename without extension
-    f = os.path.basename(cth_file).split('.')[0]
-    # replace minutes in filename by current (interpolated) timestamp
-    f = f[:15] + f"{int(f[15:17])+time_step*time_interval:02d}" + f[17:]
-    # add interpolation method and extension
-    return f"{f}_interpol{interpol}.nc"
+
+    return cth_files
+
+
+def get_filename_for_interpolated_month(timestamp, time_interval=5, interpol='linear'):
+    """
+    Name of the monthly file of the interpolated CTH, e.g. CTXin202206_interpollinear_5min.nc
+    """
+    return f"CTXin{timestamp.year}{timestamp.month:02d}_interpol{interpol}_{time_interval}min.nc"
+
+
+def read_cth_field(cth_file, var='ctth_alti'):
+    """
+    Read and decode a single variable of a CTH file.
+
+    Returns:
+    xarray.DataArray: The variable with its singleton time dimension.
+    """
+    drop_vars = [x for x in all_cth_vars if x != var]
+    with xr.open_dataset(cth_file, drop_variables=drop_vars) as data:
+        return data[var].load()
+
+
+def interpolate_cth_fields(previous, following, weight, interpol='linear'):
+    """
+    Interpolate between two consecutive CTH fields.
+
+    Parameters:
+    previous (numpy.ndarray): Field at the previous CTH timestamp.
+    following (numpy.ndarray): Field at the following CTH timestamp.
+    weight (float): Position of the interpolated timestamp between the two, from 0 (previous) to 1 (following).
+    interpol (str): Interpolation method ('linear', 'nearest', 'previous', 'next').
+
+    Returns:
+    numpy.ndarray: Interpolated field.
+    """
+    if interpol in ('linear', 'slinear'):
+        return previous + (following - previous) * weight
+    if interpol == 'nearest':
+        # ties go to the previous timestamp as in scipy interp1d
+        return previous if weight <= 0.5 else following
+    if interpol in ('previous', 'zero'):
+        return previous
+    if interpol == 'next':
+        return following
+    raise ValueError(f'interpolation method {interpol} not supported, use linear, nearest, previous or next')
+
+
+def stream_interpolated_cth(cth_files, var='ctth_alti', time_interval=5, interpol='linear'):
+    """
+    Generator of the CTH fields interpolated in time. Each CTH file is opened and decoded once
+    and only the previous field is kept in memory. The timestamps between two consecutive CTH files
+    are interpolated, pairs with a missing CTH file in between are skipped.
+
+    Parameters:
+    cth_files (list): Sorted paths of the CTH files.
+    var (str): Variable to interpolate.
+    time_interval (int): Time resolution in minutes of the interpolated timestamps.
+    interpol (str): Interpolation method, see interpolate_cth_fields.
+
+    Yields:
+    tuple: Interpolated timestamp (datetime) and field (xarray.DataArray with a singleton time dimension).
+    """
+    n_steps = cth_res // time_interval
+    previous, dt_previous = None, None
+    count_missing = 0
+
+    for cthfile in cth_files:
+        dt_following = get_datetime_cth(os.path.basename(cthfile))
+        following = read_cth_field(cthfile, var)
+
+        if previous is not None:
+            # check if the files are consecutive
+            if dt_following - dt_previous != timedelta(minutes=cth_res):
+                print(f"Skipping timestamps after {dt_previous} because the consecutive timestamp is missing.")
+                count_missing += 1
+            else:
+                # only the interpolated timestamps, the original ones are already in the CTH files
+                for step in range(1, n_steps):
+                    timestamp = dt_previous + timedelta(minutes=step*time_interval)
+                    values = interpolate_cth_fields(previous.values, following.values, step / n_steps, interpol)
+                    field = previous.copy(data=values).assign_coords(time=[np.datetime64(timestamp, 'ns')])
+                    yield timestamp, field
+
+        previous, dt_previous = following, dt_following
+
+    print(f"{count_missing} missing consecutive CTH timestamps")
+
 
 # %%
-def interpolate_and_save(cth_files, var='ctth_alti', time_interval=5, interpol='linear', plot_path=None):
+def interpolate_and_save(cth_files, var='ctth_alti', time_interval=5, interpol='linear'):
+    """
+    Interpolate the CTH files in time and write the interpolated timestamps
+    in one chunked, time-indexed netCDF file per month.
+    """
     # create subfolder for different interpolation method
     out_path = os.path.join(output_folder, interpol)
-    os.makedirs(out_path, exist_ok=True)
 
-    # loop over cth files
-    count_missing = 0
-    for f, cthfile in enumerate(cth_files[:-1]):
-        previous_file = cthfile
-        following_file = cth_files[f+1]
-
-        # check if the files are consecutive
-        dt_previous = get_datetime_cth(os.path.basename(previous_file))
-        dt_following = get_datetime_cth(os.path.basename(following_file))
-        if dt_following - dt_previous != timedelta(minutes=15):
-            print(f"Skipping {previous_file} because the consecutive timestamp is missing.")
-            count_missing += 1
-            continue
-
-        # open the files
-        drop_vars = [x for x in all_cth_vars if x != var]
-        with xr.open_mfdataset([previous_file, following_file], drop_variables=drop_vars) as data:
-            data_xarray = data
-        
-        # interpolate to 5 minutes timestamps
-        data_resampled = data_xarray.resample(time=f'{time_interval}T').interpolate(kind=interpol)
-
-        # save each interpolated timestamp in a separate file
-        for t, timestamp in enumerate(data_resampled.time.values):
-            dt =  pd.to_datetime(timestamp)
-
-            # to save only the interpolated timestamps - continue if dt is original timestamp
-            if dt == dt_previous or dt == dt_following:
-                continue
-            
-            # create folder if it does not exist
-            folder = os.path.join(out_path, f"{dt.year}/{dt.month:02d}/{dt.day:02d}")
-            os.makedirs(folder, exist_ok=True)
-
-            # get output file name
-            out_name = get_filename_for_interpolated_timestamps(cthfile, t, time_interval=time_interval, interpol=interpol)
-            
-            # save file
-            data_resampled[var][t].to_netcdf(os.path.join(folder, out_name))
-            # CTXin20220930114500405SVMSGI1UD.nc
-        
-        # if plot_path is not None:
-        #     # create subplots for each timestamp
-        #     fig, axes = plt.subplots(1, len(data_resampled.time), figsize=(10, 3))
-        #     fig.suptitle(interpol)
-        #     # loop over timestamps and plot the data
-        #     for t in range(len(data_resampled.time)):
-        #         # time stamp
-        #         dt =  pd.to_datetime(data_resampled.time[t].values)
-
-        #         # Get hour and minute
-        #         hour = dt.hour
-        #         minute = dt.minute
-        #         # plot in subplot
-        #         ax = axes[t]
-        #         ax.set_title(f"{hour:02d}:{minute:02d}")
-        #         # plot the data
-        #         ax.imshow(data_resampled[var][t].values[-50:, -50:], origin='lower', vmin=0, vmax=15000)
-        #         # data_resampled[var][t].plot()
-        #     plt.savefig(os.path.join(plot_path, f"{interpol}_{dt.strftime('%Y%m%d_%H%M')}.png"))
-        #     plt.show()
-        #     plt.close()
+    writer = None
+    for timestamp, field in stream_interpolated_cth(cth_files, var, time_interval, interpol):
+        folder = os.path.join(out_path, f"{timestamp.year}/{timestamp.month:02d}/")
+        out_name = get_filename_for_interpolated_month(timestamp, time_interval=time_interval, interpol=interpol)
 
-# %%
-interpolate_and_save(cth_files, var='ctth_alti', time_interval=5, interpol='linear')
-
-
-# %%start = data_xarray.time.values[0]
-end = data_xarray.time.values[-1]
-print(start, end, start<end)
-# ts_new = compute_timestamps_from_time_range(start, end, time_interval=5)
-# print(ts_new)
-# create subplots for each timestamp
-fig, axes = plt.subplots(1, len(data_xarray.time), figsize=(10, 3))
-# loop over timestamps and plot the data
-for t in range(len(data_xarray.time)):
-    # time stamp
-    dt =  pd.to_datetime(data_xarray.time[t].values)
-
-    # Get hour and minute
-    hour = dt.hour
-    minute = dt.minute
-    # plot in subplot
-    ax = axes[t]
-    ax.set_title(f"{hour:02d}:{minute:02d}")
-    # plot the data
-    ax.imshow(data_xarray[var][t].values[-50:, -50:], origin='lower', vmin=0, vmax=15000)
-    # data_resampled[var][t].plot()
-plt.show()
-plt.close()
+        #open the writer of a new monthly file when the month changes
+        if writer is None or writer.path != folder+out_name:
+            if writer is not None:
+                writer.close()
+            writer = DailyNetCDFWriter(folder, out_name, nc_chunk_sizes, nc_compression)
+
+        writer.write(field.to_dataset(name=var))
+
+    if writer is not None:
+        writer.close()
 
 # %%
-methods = ['linear', 'nearest']
+if __name__ == "__main__":
+    os.makedirs(output_folder, exist_ok=True)
 
-for method in methods:
-    print(method)
-    if method != 'polynomial':
-        data_resampled = data_xarray.resample(time='5T').interpolate(kind=method)
-    else:
-        data_resampled = data_xarray.resample(time='5T').interpolate(kind='polynomial', order=3)
-    
+    cth_files = generate_interpolated_CTH_timestamps(year, start_date, end_date, output_folder, interpol_res, interpol_method)
 
+    interpolate_and_save(cth_files, var='ctth_alti', time_interval=interpol_res, interpol=interpol_method)
@@ -1,99 +1,156 @@
+"""
+Regrid the European DEM (Lambert azimuthal equal area grid) to a regular lat/lon grid over EXPATS.
+The target grid is split in tiles that are regridded in parallel: for each tile only the block
+of the DEM around it (with a margin) is read and transformed to lat/lon, so the memory needed
+is bounded by the tile size and not by the size of the DEM. The interpolation weights of each tile
+are cached on disk, so the DEM can be regridded again (e.g. a new version on the same grid) without
+triangulating it.
+The regridded DEM is saved in dem_path of config_satpy_process.py.
+
+@author: Daniele Corradini
+"""
 import xarray as xr
 from pyproj import Transformer
 import numpy as np
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
 
-from regrid_functions import regrid_data, generate_regular_grid
+from regrid_functions import generate_regular_grid, get_regrid_plan
+from config_satpy_process import dem_path
 
 path_to_files = "/data/sat/msg/orography/"
 nc_file = 'RA-Europe-DEM.nc'
 
-path_out = "/data/sat/msg/orography/DEM_expats_1km-reg-grid.nc"
+#regridded DEM, read by the orography analyses
+path_out = dem_path
+
+# Folder to cache the regridding weights of the tiles
+regrid_cache_dir = "/data/sat/msg/orography/regrid_plans/"
+
+# Number of target grid points per side of each tile and margin (m) of DEM read around it
+tile_size = 200
+tile_margin = 5000
+
+# Number of parallel processes (None: number of CPUs)
+n_workers = None
 
 # Define the bounding box for cropping (lonmin, lonmax, latmin, latmax)
 lonmin, lonmax = 5, 16
 latmin, latmax = 42, 51.5
 grid_size = 0.01
 
-# Load the dataset
-ds = xr.open_dataset(path_to_files+nc_file)
-
-# Extract GeoTransform parameters (you may need to adjust parsing depending on the format)
-geo_transform = ds.spatial_ref.attrs['GeoTransform'].split()
-
-# Extract the CRS (coordinate reference system)
-src_crs_wkt = ds.spatial_ref.attrs['crs_wkt']
-
-# Define the transformer from LAEA (current CRS) to lat/lon (WGS84)
-transformer = Transformer.from_crs(src_crs_wkt, "EPSG:4326", always_xy=True)
-
-# Get the grid of x and y coordinates
-x = ds['x'].values
-y = ds['y'].values
+def get_dem_crs(dem_path):
+    """
+    Returns the CRS (WKT) of the DEM and its 1D x and y coordinates.
+    """
+    with xr.open_dataset(dem_path) as ds:
+        # Extract the CRS (coordinate reference system)
+        src_crs_wkt = ds.spatial_ref.attrs['crs_wkt']
+        x = ds['x'].values
+        y = ds['y'].values
+    return src_crs_wkt, x, y
 
-# Meshgrid to create all combinations of x and y
-xv, yv = np.meshgrid(x, y)
 
-# Apply transformation (from projected coordinates to lat/lon)
-lon, lat = transformer.transform(xv, yv)
+def find_dem_window(tile_lat, tile_lon, src_crs_wkt, x, y, margin):
+    """
+    Finds the block of the DEM covering a tile of the target grid.
 
-# Now assign lat/lon as new coordinates in the dataset
-ds = ds.assign_coords(lon=(('y', 'x'), lon), lat=(('y', 'x'), lat))
+    Parameters:
+    tile_lat (numpy.ndarray): 1D latitudes of the tile.
+    tile_lon (numpy.ndarray): 1D longitudes of the tile.
+    src_crs_wkt (str): CRS of the DEM.
+    x, y (numpy.ndarray): 1D projected coordinates of the DEM.
+    margin (float): Margin (in the DEM units) added around the tile.
+
+    Returns:
+    tuple: Slices of the DEM along y and x, None if the tile is outside the DEM.
+    """
+    # Define the transformer from lat/lon (WGS84) to LAEA (DEM CRS)
+    transformer = Transformer.from_crs("EPSG:4326", src_crs_wkt, always_xy=True)
 
-print(ds)
+    # transform the boundary of the tile, the projected tile is not a rectangle
+    boundary_lon = np.concatenate([tile_lon, tile_lon, np.full(len(tile_lat), tile_lon[0]), np.full(len(tile_lat), tile_lon[-1])])
+    boundary_lat = np.concatenate([np.full(len(tile_lon), tile_lat[0]), np.full(len(tile_lon), tile_lat[-1]), tile_lat, tile_lat])
+    xs, ys = transformer.transform(boundary_lon, boundary_lat)
 
-# Create a mask for selecting the desired lat/lon range
-lat_mask = (ds['lat'] >= latmin-1) & (ds['lat'] <= latmax+1)
-lon_mask = (ds['lon'] >= lonmin-1) & (ds['lon'] <= lonmax+1)
+    x_index = np.flatnonzero((x >= xs.min() - margin) & (x <= xs.max() + margin))
+    y_index = np.flatnonzero((y >= ys.min() - margin) & (y <= ys.max() + margin))
+    if len(x_index) == 0 or len(y_index) == 0:
+        return None
 
-# Combine both masks (only keep points within both lat and lon bounds)
-combined_mask = lat_mask & lon_mask
+    return slice(y_index[0], y_index[-1] + 1), slice(x_index[0], x_index[-1] + 1)
 
-# Find the indexes where the combined mask is True
-# This will give us the positions of lat/lon that are inside the desired box
-valid_points = combined_mask.where(combined_mask, drop=True)
 
-# Apply this valid point mask to actually select the data
-# Select only the non-NaN data, effectively discarding points outside the mask
-ds = ds.sel(
-    y=valid_points['y'].dropna(dim='y', how='all').coords['y'],
-    x=valid_points['x'].dropna(dim='x', how='all').coords['x']
-)
+def regrid_dem_tile(dem_path, tile_lat, tile_lon, margin, cache_dir=None):
+    """
+    Regrids the block of the DEM around a tile to the regular lat/lon points of the tile
+    with linear interpolation (RegridPlan, cached on disk if cache_dir is given).
 
-print(ds.DEM.values)
+    Parameters:
+    dem_path (str): Path to the DEM file.
+    tile_lat (numpy.ndarray): 1D latitudes of the tile.
+    tile_lon (numpy.ndarray): 1D longitudes of the tile.
+    margin (float): Margin (in the DEM units) of DEM read around the tile.
+    cache_dir (str): Folder to cache the regridding weights of the tile.
+
+    Returns:
+    numpy.ndarray: DEM on the tile (lat, lon), NaN outside the DEM.
+    """
+    src_crs_wkt, x, y = get_dem_crs(dem_path)
+    window = find_dem_window(tile_lat, tile_lon, src_crs_wkt, x, y, margin)
+    if window is None:
+        return np.full((len(tile_lat), len(tile_lon)), np.nan)
 
+    # read only the block of the DEM
+    with xr.open_dataset(dem_path) as ds:
+        block = ds['DEM'].isel(y=window[0], x=window[1]).values
 
-# Create a regular grid with 0.01-degree resolution in lat/lon
-lat_new, lon_new = generate_regular_grid(latmin,latmax,lonmin,lonmax,grid_size)
+    # Apply transformation of the block coordinates (from projected coordinates to lat/lon)
+    transformer = Transformer.from_crs(src_crs_wkt, "EPSG:4326", always_xy=True)
+    xv, yv = np.meshgrid(x[window[1]], y[window[0]])
+    lon, lat = transformer.transform(xv, yv)
 
-lat_reg_grid, lon_reg_grid = np.meshgrid(lat_new, lon_new, indexing='ij')
-print(lat_reg_grid)
-print(lon_reg_grid)
-print(ds.lat.values)
-print(ds.lon.values) 
-print(ds.DEM.values)
+    # Interpolate to the regular grid of the tile
+    lat_tile_grid, lon_tile_grid = np.meshgrid(tile_lat, tile_lon, indexing='ij')
+    regrid_plan = get_regrid_plan(lat, lon, lat_tile_grid, lon_tile_grid, 'linear', cache_dir)
+    return regrid_plan.apply(block.astype(np.float64))
 
-# Interpolate to a regular grid 
-regrid_DEM_data = regrid_data(ds.lat.values, ds.lon.values, ds.DEM.values, lat_reg_grid, lon_reg_grid, 'linear')
 
-print(regrid_data)
+def regrid_dem_tiled(dem_path, lat_new, lon_new, tile_size=200, margin=5000, n_workers=None, cache_dir=None):
+    """
+    Regrids the DEM to a regular lat/lon grid, tile by tile in a pool of processes.
 
-# Create a new xarray dataset with 1D lat/lon coordinates
-cropped_ds = xr.Dataset(
-    {
-        'DEM': (['lat', 'lon'], regrid_DEM_data)
-    },
-    coords={
-        'lat': lat_new,
-        'lon': lon_new
-    }
-)
+    Parameters:
+    dem_path (str): Path to the DEM file.
+    lat_new (numpy.ndarray): 1D latitudes of the regular grid.
+    lon_new (numpy.ndarray): 1D longitudes of the regular grid.
+    tile_size (int): Number of grid points per side of each tile.
+    margin (float): Margin (in the DEM units) of DEM read around each tile, so that
+                    the interpolation at the tile edges uses the same points as without tiles.
+    n_workers (int): Number of processes (None: number of CPUs).
+    cache_dir (str): Folder to cache the regridding weights of the tiles.
+
+    Returns:
+    numpy.ndarray: DEM on the regular grid (lat, lon).
+    """
+    regrid_DEM_data = np.full((len(lat_new), len(lon_new)), np.nan)
+    tiles = [(slice(i, i + tile_size), slice(j, j + tile_size))
+             for i in range(0, len(lat_new), tile_size)
+             for j in range(0, len(lon_new), tile_size)]
 
-print(cropped_ds)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(regrid_dem_tile, dem_path, lat_new[tile[0]], lon_new[tile[1]], margin, cache_dir): tile
+                   for tile in tiles}
 
+        for n, future in enumerate(concurrent.futures.as_completed(futures)):
+            tile = futures[future]
+            regrid_DEM_data[tile] = future.result()
+            print(f"tile {n+1}/{len(tiles)} regridded")
 
+    return regrid_DEM_data
 
 
 def plot_dem(cropped_ds, title="DEM Data", cmap="terrain"):
@@ -131,11 +188,31 @@ def plot_dem(cropped_ds, title="DEM Data", cmap="terrain"):
     fig.savefig(path_out.split('.')[0]+'.png', bbox_inches='tight')
 
 
-# Call the plotting function after regridding the dataset
-#plot_dem(cropped_ds, title="Cropped and Regridded DEM")
+if __name__ == "__main__":
+    # Create a regular grid with 0.01-degree resolution in lat/lon
+    lat_new, lon_new = generate_regular_grid(latmin,latmax,lonmin,lonmax,grid_size)
+
+    # Interpolate to a regular grid, tile by tile
+    regrid_DEM_data = regrid_dem_tiled(path_to_files+nc_file, lat_new, lon_new, tile_size, tile_margin, n_workers,
+                                       regrid_cache_dir)
+
+    # Create a new xarray dataset with 1D lat/lon coordinates
+    cropped_ds = xr.Dataset(
+        {
+            'DEM': (['lat', 'lon'], regrid_DEM_data)
+        },
+        coords={
+            'lat': lat_new,
+            'lon': lon_new
+        }
+    )
+
+    print(cropped_ds)
 
+    # Call the plotting function after regridding the dataset
+    #plot_dem(cropped_ds, title="Cropped and Regridded DEM")
 
-# Optionally, you can save the transformed dataset to a new file
-cropped_ds.to_netcdf(path_out)
+    # Optionally, you can save the transformed dataset to a new file
+    cropped_ds.to_netcdf(path_out)
 
-print("Transformation and interpolation complete. The dataset is now in a regular lat/lon grid.")
+    print("Transformation and interpolation complete. The dataset is now in a regular lat/lon grid.")
@@ -6,10 +6,10 @@
 ### constants taken from www-cdn.eumetsat.int/files/2020-04/pdf_effect_rad_to_brightness.pdf
 
 # %%
+from functools import lru_cache
 import numpy as np
 import xarray as xr
-import pvlib
-from pvlib.location import Location
+from pyorbital.astronomy import sun_zenith_angle
 
 # %%
 #############
@@ -87,6 +87,10 @@ IRRAD = {'MSG1': {"channel_1": 65.2296, "channel_2": 73.0127, "channel_3": 62.37
          'MSG4': {"channel_1": 65.2656, "channel_2": 73.1692, "channel_3": 61.9416}, }
 
 
+# channel numbers of the brightness temperature and of the reflectance channels
+IR_CHANNELS = np.arange(4, 12)
+VIS_NIR_CHANNELS = np.arange(1, 4)
+
 # %%
 class ir_channel:
     """
@@ -105,9 +109,41 @@ class vis_nir_channel:
         self.name = CHANNEL_NAME[channel]
         self.irrad = IRRAD[satellite][channel]  # irradiance at 1AU in [mW·m-2·(cm-1)-1]
 
+
+@lru_cache(maxsize=None)
+def calibration_coefficients(satellite):
+    """
+    Coefficients of all the channels of a satellite as arrays indexed by channel number
+    (NaN for the channels where the coefficient is not defined), computed once per satellite.
+    """
+    n_channels = len(CHANNEL_NAME) + 1
+    coeffs = {name: np.full(n_channels, np.nan) for name in ('vc', 'alpha', 'beta', 'irrad')}
+    for ch in IR_CHANNELS:
+        channel_consts = ir_channel(satellite, f"channel_{ch}")
+        coeffs['vc'][ch] = channel_consts.vc
+        coeffs['alpha'][ch] = channel_consts.alpha
+        coeffs['beta'][ch] = channel_consts.beta
+    for ch in VIS_NIR_CHANNELS:
+        coeffs['irrad'][ch] = vis_nir_channel(satellite, f"channel_{ch}").irrad
+    return coeffs
+
+
+def _check_channels(channel_numbers, valid_channels, kind):
+    channel_numbers = np.atleast_1d(channel_numbers)
+    if not np.isin(channel_numbers, valid_channels).all():
+        raise ValueError(f"channels {channel_numbers.tolist()} not valid for {kind}, must be in {valid_channels.tolist()}")
+    return channel_numbers
+
+
+def _along_first_axis(values, ndim):
+    # reshape per channel values to broadcast over the (channel, y, x) cube
+    return values.reshape((-1,) + (1,) * (ndim - 1))
+
+
 class MSG_satellite:
     def __init__(self, name):
         self.name =  name
+        self.coeffs = calibration_coefficients(name)
 
     def _get_channel(self, channel_number):
         # return vis/nir or ir channel depending on channel number
@@ -117,54 +153,94 @@ class MSG_satellite:
             return ir_channel(satellite=self.name, channel=f"channel_{channel_number}")
 
     def rad_2_tb(self, channel_number, radiances):
-        # error handling here:
-        # TODO: raise exception when given incorrect channel_number, must be >=4
+        """
+        Brightness temperature [K] of the radiances of one IR channel (4-11) or of a
+        (channel, y, x) cube of radiances of several IR channels (channel_number is then a list).
+        radiances in [mW m−2 sr−1 (cm−1)−1)]
+        """
+        channel_numbers = _check_channels(channel_number, IR_CHANNELS, 'brightness temperature')
+        radiances = np.asarray(radiances)
 
-        # get constants for given channel
-        channel_consts = self._get_channel(channel_number)
+        # get constants for given channels, broadcast along the channel axis of a cube
+        ndim = radiances.ndim if np.ndim(channel_number) else 0
+        vc = _along_first_axis(self.coeffs['vc'][channel_numbers], ndim)
+        alpha = _along_first_axis(self.coeffs['alpha'][channel_numbers], ndim)
+        beta = _along_first_axis(self.coeffs['beta'][channel_numbers], ndim)
 
         # converting radiance to brightness temperature [K] with simplified equation
-        numerator = C2 * channel_consts.vc
-        fraction = C1 * channel_consts.vc**3 / radiances + 1
-        denominator = channel_consts.alpha * (np.log(fraction))
-        tb = numerator / denominator - channel_consts.beta / channel_consts.alpha  ## [K]
+        numerator = C2 * vc
+        fraction = C1 * vc**3 / radiances + 1
+        denominator = alpha * (np.log(fraction))
+        tb = numerator / denominator - beta / alpha  ## [K]
         return tb
+
+    def rad_2_tb_cube(self, radiances):
+        """
+        Brightness temperatures [K] of all the IR channels (4-11) from a (8, y, x) cube of radiances.
+        """
+        return self.rad_2_tb(IR_CHANNELS, radiances)
     
+    @staticmethod
     def _d(t):
-        # Sun-Earth distance in AU at time t
-        return None
+        # Sun-Earth distance in AU at time t (datetime or numpy.datetime64)
+        day_of_year = _day_of_year(t)
+        return 1 - 0.0167 * np.cos(2 * np.pi * (day_of_year - 3) / 365)
     
+    @staticmethod
     def _solar_zenith_angle(t, lon, lat):
-        # Solar Zenith Angle in Radians at time t and location x
-        return None
+        # Solar Zenith Angle in Radians at time t (UTC) and location (lon, lat in degrees),
+        # vectorized over the grid (same astronomical formulas used by Satpy)
+        return np.deg2rad(sun_zenith_angle(np.datetime64(t, 'ms'), np.asarray(lon), np.asarray(lat)))
 
     def rad_2_refl(self, channel_number, radiances, t, lon, lat):
-        # error handling here:
-        # TODO: raise exception when given incorrect channel_number, must be <= 3
+        """
+        Reflectance (0-1) of the radiances of one VIS/NIR channel (1-3) or of a (channel, y, x) cube
+        of radiances of several VIS/NIR channels (channel_number is then a list), at time t on the
+        grid of lon/lat. The solar zenith angle is computed once for all the channels.
+        Pixels where the sun is below the horizon are NaN.
+        """
+        channel_numbers = _check_channels(channel_number, VIS_NIR_CHANNELS, 'reflectance')
+        radiances = np.asarray(radiances)
 
-        # get constants for given channel
-        channel_consts = self._get_channel(channel_number)
+        # get constants for given channels, broadcast along the channel axis of a cube
+        ndim = radiances.ndim if np.ndim(channel_number) else 0
+        irrad = _along_first_axis(self.coeffs['irrad'][channel_numbers], ndim)
+
+        cos_zenith = np.cos(self._solar_zenith_angle(t, lon, lat))
+        cos_zenith = np.where(cos_zenith > 0, cos_zenith, np.nan)
 
         numerator = np.pi * radiances * self._d(t)**2
-        denominator = channel_consts.irrad * np.cos(self._solar_zenith_angle(t, lon, lat))
+        denominator = irrad * cos_zenith
+        return numerator / denominator
+
+    def rad_2_refl_cube(self, radiances, t, lon, lat):
+        """
+        Reflectances of all the VIS/NIR channels (1-3) from a (3, y, x) cube of radiances.
+        """
+        return self.rad_2_refl(VIS_NIR_CHANNELS, radiances, t, lon, lat)
+
+
+def _day_of_year(t):
+    t = np.datetime64(t, 'D')
+    return (t - t.astype('datetime64[Y]')) / np.timedelta64(1, 'D') + 1
 
 # %%
-def radiances_2_brightnesstemp_and_reflectances(radiances, channel_number, satellite_name):
+def radiances_2_brightnesstemp_and_reflectances(radiances, channel_number, satellite_name, t=None, lon=None, lat=None):
     ## radiances in [mW m−2 sr−1 (cm−1)−1)]
-    # TODO: add constraint to channel_number (must be >= 4)
+    ## for the visible and near-infrared channels also the time and the lon/lat of the pixels are needed
 
     # access correct satellite 
     satellite = MSG_satellite(satellite_name)
-    if channel_number <= 3:
-        print("not implemented yet for visible and near-infrared")
+    if channel_number in VIS_NIR_CHANNELS:
+        # get reflectance for given channel
+        return satellite.rad_2_refl(channel_number, radiances, t, lon, lat)
 
-    elif channel_number >= 4 and channel_number < 12:
+    elif channel_number in IR_CHANNELS:
         # get brightness temp fro given channel
         return satellite.rad_2_tb(channel_number, radiances)
     
     else:
-        print(f"This channel does not exist for satellite {satellite_name}")
-        # TODO: raise exception
+        raise ValueError(f"This channel does not exist for satellite {satellite_name}")
 
 
 # %%
@@ -180,12 +256,10 @@ if __name__ == '__main__':
     satellite_name = data.EPCT_product_name.split('-')[0]
     print(satellite_name)
 
-    # loop over all brightness temp channels
-    for ch in np.arange(4, 12, 1):
-        radiances = data[f"channel_{ch}"].values
-
-        print(radiances)
-        tb = radiances_2_brightnesstemp_and_reflectances(radiances, ch, satellite_name)
-        print(tb)
+    # all brightness temp channels at once from a (channel, y, x) cube
+    satellite = MSG_satellite(satellite_name)
+    radiances = np.stack([data[f"channel_{ch}"].values for ch in IR_CHANNELS])
+    tb = satellite.rad_2_tb_cube(radiances)
+    print(tb)
 
 # %%
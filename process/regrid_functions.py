@@ -4,12 +4,30 @@ It includes utilities for generating a regular grid based
 on specified geographic boundaries and resolution, 
 regridding data from an old grid to a new grid, 
 and filling missing data within a dataset using interpolation.
+It also provides a RegridPlan that precomputes the interpolation
+weights between two fixed grids, so that they can be reused for
+many fields and cached on disk. The weights can be computed with
+scipy (Delaunay/cKDTree on lat/lon) or, if installed, with pyresample
+resampling to an area definition of the regular grid.
 
 @author: Daniele Corradini
 """
 
+import os
+import hashlib
+import warnings
 import numpy as np
 from scipy.interpolate import griddata
+from scipy.spatial import Delaunay, cKDTree
+from scipy.sparse import csr_matrix
+from scipy.ndimage import distance_transform_edt
+
+#pyresample is only needed by the pyresample regridding backend
+try:
+    from pyresample import AreaDefinition, SwathDefinition
+    from pyresample import kd_tree, bilinear
+except ImportError:
+    AreaDefinition = None
 
 def generate_regular_grid(lat_min, lat_max, lon_min, lon_max, step_deg, path=None):
     """
@@ -37,65 +55,425 @@ def regrid_data(old_lat, old_lon, old_data, new_lat, new_lon, method='linear'):
     """
     Regrid data from an old grid to a new grid. If the old data contains only NaN values,
     returns a NaN-filled array matching the shape of the new grid.
+    Several fields can be regridded at once by stacking them along a leading (channel) axis,
+    in this case the triangulation of the old grid is shared by all the channels.
 
     :param old_lat: 2D array of latitudes for the old grid.
     :param old_lon: 2D array of longitudes for the old grid.
-    :param old_data: 2D array of data corresponding to the old grid.
+    :param old_data: 2D array of data corresponding to the old grid, or 3D array (channel, y, x).
     :param new_lat: 2D array of latitudes for the new grid.
     :param new_lon: 2D array of longitudes for the new grid.
     :param method: Interpolation method ('linear', 'nearest', 'cubic').
-    :return: 2D array of regridded data corresponding to the new grid.
+    :return: 2D array of regridded data corresponding to the new grid, or 3D array (channel, lat, lon).
     """
-    # Check if all data points in the old_data are NaN
-    if np.all(np.isnan(old_data)):
-        # Return a NaN-filled array with the same shape as the new grid
-        return np.full(new_lat.shape, np.nan)
+    # Stack of fields, one row per channel (also a single channel keeps its leading dimension)
+    stacked = old_data.ndim > np.ndim(old_lat)
+    fields = old_data.reshape(-1, old_lat.size)
+
+    # Channels where all data points are NaN stay NaN-filled on the new grid
+    all_nan = np.all(np.isnan(fields), axis=1)
+    new_data = np.full((len(fields),) + new_lat.shape, np.nan)
 
-    # Flatten the old grid coordinates and data for interpolation
-    old_coords = np.array([old_lat.ravel(), old_lon.ravel()]).T
-    old_data_flat = old_data.ravel()
+    if not all_nan.all():
+        # Flatten the old grid coordinates for interpolation
+        old_coords = np.array([old_lat.ravel(), old_lon.ravel()]).T
 
-    # Create a mesh of new grid coordinates
-    new_coords = np.array([new_lat.ravel(), new_lon.ravel()]).T
+        # Create a mesh of new grid coordinates
+        new_coords = np.array([new_lat.ravel(), new_lon.ravel()]).T
 
-    # Interpolate old data to new grid using the specified method
-    new_data_flat = griddata(old_coords, old_data_flat, new_coords, method=method)
+        # Interpolate all the channels to the new grid in one call using the specified method
+        new_data_flat = griddata(old_coords, fields[~all_nan].T, new_coords, method=method)
 
-    # Reshape the flattened data back into the 2D structure of the new grid
-    new_data = new_data_flat.reshape(new_lat.shape)
+        # Reshape the flattened data back into the 2D structure of the new grid
+        new_data[~all_nan] = new_data_flat.T.reshape((-1,) + new_lat.shape)
 
-    return new_data
+    return new_data if stacked else new_data[0]
 
 
-def fill_missing_data_with_interpolation(lat, lon, data, method='linear'):
+def fill_missing_data_with_interpolation(lat, lon, data, method='linear', engine='griddata'):
     """
     Fill missing data (NaN) with interpolation based on nearby values. If all data are NaN,
-    returns an array of the same shape filled with NaN.
+    returns an array of the same shape filled with NaN. If no data are missing, the data
+    are returned without any interpolation.
+    Several fields can be filled at once by stacking them along a leading (channel) axis,
+    channels sharing the same missing pixels are interpolated together.
 
     :param lat: 2D array of latitudes.
     :param lon: 2D array of longitudes.
-    :param data: 2D array of data with NaN values for missing data.
-    :param method: Interpolation method ('linear', 'nearest', 'cubic').
-    :return: 2D array with missing data filled or all NaN if no valid data points exist.
+    :param data: 2D array of data with NaN values for missing data, or 3D array (channel, y, x).
+    :param method: Interpolation method ('linear', 'nearest', 'cubic'; 'linear' or 'nearest' for the grid engine).
+    :param engine: 'griddata' to interpolate over the lat/lon of all the valid points, or 'grid' to fill
+                   the missing pixels from their neighbours in the image (y, x), see fill_missing_data_on_grid.
+    :return: Array with missing data filled or all NaN if no valid data points exist.
     """
-    # Mask to identify valid (non-NaN) data points
-    valid_mask = ~np.isnan(data)
-    # Check if there are any valid data points
-    if not valid_mask.any():
-        # Return an array of NaNs with the same shape as the input data if no valid data points
-        return np.full(data.shape, np.nan)
+    # Nothing to fill
+    missing = np.isnan(data)
+    if not missing.any():
+        return np.array(data, dtype=np.float64)
+
+    if engine == 'grid':
+        return fill_missing_data_on_grid(data, method)
+    elif engine != 'griddata':
+        raise ValueError(f'unknown gap filling engine {engine}, use griddata or grid')
+
+    # Stack of fields, one row per channel
+    stacked = data.ndim == 3
+    fields = data.reshape(-1, lat.size)
+    filled_data = np.full(fields.shape, np.nan)
+
+    # Mask to identify valid (non-NaN) data points, grouping channels with the same mask
+    valid_masks, groups = np.unique(~missing.reshape(fields.shape), axis=0, return_inverse=True)
+
+    for g, valid_mask in enumerate(valid_masks):
+        # Skip channels without any valid data points, they stay NaN-filled
+        if not valid_mask.any():
+            continue
+
+        # Coordinates and data of valid points
+        group_channels = np.flatnonzero(groups.ravel() == g)
+        valid_data = fields[group_channels][:, valid_mask]
+        valid_lat = lat.ravel()[valid_mask]
+        valid_lon = lon.ravel()[valid_mask]
+
+        # Linear interpolation for missing data
+        filled_data[group_channels] = griddata((valid_lat, valid_lon), valid_data.T, (lat.ravel(), lon.ravel()), method=method).T
+
+    return filled_data.reshape(data.shape) if stacked else filled_data.reshape(lat.shape)
+
+
+def fill_missing_data_on_grid(data, method='linear'):
+    """
+    Fill missing data (NaN) using the regular (y, x) layout of the image instead of the lat/lon
+    of the pixels, so no triangulation is needed and only the missing pixels are computed.
+    With 'linear', each missing pixel is interpolated between the closest valid pixels above and
+    below in the same column (e.g. across missing scan lines), or takes the value of the only one
+    found. With 'nearest', or for columns without any valid pixel, the nearest valid pixel in the
+    image (distance transform) is used. Unlike griddata, pixels on the border are filled too.
+
+    :param data: 2D array of data with NaN values for missing data, or 3D array (channel, y, x).
+    :param method: Interpolation method ('linear', 'nearest').
+    :return: Array with missing data filled, channels without valid data stay NaN.
+    """
+    if method not in ('linear', 'nearest'):
+        raise ValueError(f'the grid engine does not support method {method}, use linear or nearest')
+
+    fields = np.array(data, dtype=np.float64).reshape((-1,) + data.shape[-2:])
+    missing = np.isnan(fields)
+    n_y = fields.shape[1]
+
+    if method == 'linear':
+        # closest valid row above and below each pixel, in the same column
+        rows = np.arange(n_y)[None, :, None]
+        above = np.maximum.accumulate(np.where(missing, -1, rows), axis=1)
+        below = np.minimum.accumulate(np.where(missing, n_y, rows)[:, ::-1], axis=1)[:, ::-1]
+
+        c, i, j = np.nonzero(missing)
+        i_above, i_below = above[c, i, j], below[c, i, j]
+        has_above, has_below = i_above >= 0, i_below < n_y
+
+        values = np.full(len(c), np.nan)
+        both = has_above & has_below
+        weight = (i[both] - i_above[both]) / (i_below[both] - i_above[both])
+        values[both] = (fields[c[both], i_above[both], j[both]] * (1 - weight)
+                        + fields[c[both], i_below[both], j[both]] * weight)
+        only_above = has_above & ~has_below
+        values[only_above] = fields[c[only_above], i_above[only_above], j[only_above]]
+        only_below = has_below & ~has_above
+        values[only_below] = fields[c[only_below], i_below[only_below], j[only_below]]
+
+        fields[c, i, j] = values
+        missing = np.isnan(fields)
+
+    # nearest valid pixel for the remaining missing pixels, one distance transform per channel
+    for ch in np.flatnonzero(missing.any(axis=(1, 2))):
+        if missing[ch].all():
+            continue
+        nearest_y, nearest_x = distance_transform_edt(missing[ch], return_distances=False, return_indices=True)
+        fields[ch][missing[ch]] = fields[ch][nearest_y[missing[ch]], nearest_x[missing[ch]]]
+
+    return fields.reshape(data.shape)
+
+
+class RegridPlan:
+    """
+    Precomputed regridding from a fixed (old) grid to a fixed (new) grid.
+
+    The Delaunay triangulation (linear) or the nearest-neighbour search (nearest)
+    of the old grid is done only once when the plan is created. The resulting
+    weights are stored as a sparse matrix (linear) or as an index array (nearest),
+    so any number of fields defined on the old grid can be regridded with a single
+    sparse matrix multiply or gather. Results match regrid_data with the same method.
+    """
+
+    def __init__(self, old_lat, old_lon, new_lat, new_lon, method='linear'):
+        """
+        :param old_lat: 2D array of latitudes for the old grid.
+        :param old_lon: 2D array of longitudes for the old grid.
+        :param new_lat: 2D array of latitudes for the new grid.
+        :param new_lon: 2D array of longitudes for the new grid.
+        :param method: Interpolation method ('linear', 'nearest').
+        """
+        if method not in ('linear', 'nearest'):
+            raise ValueError(f'RegridPlan does not support method {method}, use linear or nearest')
+
+        self.method = method
+        self.n_source = np.size(old_lat)
+        self.new_shape = np.shape(new_lat)
+        self.matrix = None
+        self.indices = None
+        self.outside = np.array([], dtype=int)
+
+        # Flatten the grid coordinates, skipping old points without valid coordinates
+        old_coords = np.array([np.ravel(old_lat), np.ravel(old_lon)]).T
+        valid_source = np.flatnonzero(np.isfinite(old_coords).all(axis=1))
+        new_coords = np.array([np.ravel(new_lat), np.ravel(new_lon)]).T
+        n_target = len(new_coords)
+
+        if method == 'nearest':
+            # Index of the closest old point for each new point
+            tree = cKDTree(old_coords[valid_source])
+            _, nearest = tree.query(new_coords)
+            self.indices = valid_source[nearest]
+        else:
+            # Triangulate the old grid and find the triangle enclosing each new point
+            tri = Delaunay(old_coords[valid_source])
+            simplex = tri.find_simplex(new_coords)
+            inside = np.flatnonzero(simplex >= 0)
+
+            # Barycentric coordinates of the new points inside the triangles
+            transform = tri.transform[simplex[inside]]
+            bary = np.einsum('nij,nj->ni', transform[:, :2, :], new_coords[inside] - transform[:, 2, :])
+            weights = np.column_stack([bary, 1 - bary.sum(axis=1)])
+            vertices = valid_source[tri.simplices[simplex[inside]]]
+
+            # Points outside the convex hull have no weights and are set to NaN in apply
+            rows = np.repeat(inside, 3)
+            self.matrix = csr_matrix((weights.ravel(), (rows, vertices.ravel())), shape=(n_target, self.n_source))
+            self.outside = np.setdiff1d(np.arange(n_target), inside)
+
+    def apply(self, old_data):
+        """
+        Regrid one or more fields defined on the old grid.
+
+        :param old_data: Array of data on the old grid, either 2D or with leading dimensions
+                         (e.g. channel, y, x) stacked before the grid dimensions.
+        :return: Array of regridded data with the leading dimensions followed by the new grid shape.
+        """
+        old_data = np.asarray(old_data)
+        n_fields = old_data.size // self.n_source
+        lead_shape = old_data.shape[:-2] if old_data.ndim > 2 else ()
+        data_flat = old_data.reshape(n_fields, self.n_source).T
+
+        if self.method == 'nearest':
+            new_data_flat = data_flat[self.indices]
+            if self.outside.size:
+                # new points without a close enough old point (pyresample backend)
+                new_data_flat = new_data_flat.astype(np.float64)
+                new_data_flat[self.outside] = np.nan
+        else:
+            new_data_flat = np.asarray(self.matrix @ data_flat, dtype=np.float64)
+            new_data_flat[self.outside] = np.nan
+
+        return new_data_flat.T.reshape(lead_shape + self.new_shape)
 
-    # Coordinates and data of valid points
-    valid_data = data[valid_mask]
-    valid_lat = lat[valid_mask]
-    valid_lon = lon[valid_mask]
+    def save(self, path):
+        """
+        Save the plan to a .npz file.
 
-    # Linear interpolation for missing data
-    filled_data = griddata((valid_lat, valid_lon), valid_data, (lat, lon), method=method)
+        :param path: Path of the output file.
+        """
+        arrays = {'method': self.method, 'n_source': self.n_source, 'new_shape': self.new_shape,
+                  'outside': self.outside}
+        if self.method == 'nearest':
+            arrays['indices'] = self.indices
+        else:
+            arrays.update(data=self.matrix.data, indices=self.matrix.indices,
+                          indptr=self.matrix.indptr)
+
+        # Write to a temporary file first, so concurrent readers never see a partial plan
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a plan saved with RegridPlan.save.
+
+        :param path: Path of the .npz file.
+        :return: RegridPlan object.
+        """
+        plan = cls.__new__(cls)
+        with np.load(path) as arrays:
+            plan.method = str(arrays['method'])
+            plan.n_source = int(arrays['n_source'])
+            plan.new_shape = tuple(int(n) for n in arrays['new_shape'])
+            plan.matrix = None
+            plan.indices = None
+            # plans saved before nearest plans could have points outside have no outside array
+            plan.outside = arrays['outside'] if 'outside' in arrays else np.array([], dtype=int)
+            if plan.method == 'nearest':
+                plan.indices = arrays['indices']
+            else:
+                n_target = int(np.prod(plan.new_shape))
+                plan.matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                         shape=(n_target, plan.n_source))
+        return plan
+
+    @classmethod
+    def from_pyresample(cls, old_lat, old_lon, new_lat, new_lon, method='linear', radius_of_influence=50e3):
+        """
+        Build the plan with pyresample, resampling from the old grid (swath of lat/lon points)
+        to an area definition of the regular new grid. The neighbour info (nearest) or the
+        bilinear coefficients (linear) are converted to the same indices or sparse matrix
+        of a scipy plan, so the plan is applied and cached in the same way.
+        The results are close to but not the same as griddata: pyresample measures distances on
+        the sphere instead of in lat/lon degrees, so the nearest neighbour differs on ~1% of the
+        points (by up to the difference between adjacent pixels, ~2 K on brightness temperatures),
+        and the bilinear weights differ slightly (~0.01 K).
+
+        :param old_lat: 2D array of latitudes for the old grid.
+        :param old_lon: 2D array of longitudes for the old grid.
+        :param new_lat: 2D array of latitudes for the new regular grid (meshgrid with indexing='ij').
+        :param new_lon: 2D array of longitudes for the new regular grid (meshgrid with indexing='ij').
+        :param method: Interpolation method ('linear' for bilinear, 'nearest').
+        :param radius_of_influence: Maximum distance in meters to search for old points.
+        :return: RegridPlan object.
+        """
+        if AreaDefinition is None:
+            raise ImportError('pyresample is needed by the pyresample regridding backend')
+        if method not in ('linear', 'nearest'):
+            raise ValueError(f'RegridPlan does not support method {method}, use linear or nearest')
+
+        plan = cls.__new__(cls)
+        plan.method = method
+        plan.n_source = np.size(old_lat)
+        plan.new_shape = np.shape(new_lat)
+        plan.matrix = None
+        plan.indices = None
+
+        source_def = SwathDefinition(lons=np.asarray(old_lon, dtype=np.float64),
+                                     lats=np.asarray(old_lat, dtype=np.float64))
+        target_def = regular_grid_area_definition(new_lat, new_lon)
+        n_target = target_def.size
+
+        # the area rows go from north to south, the regular grid rows from south to north
+        area_to_grid = np.arange(n_target).reshape(plan.new_shape)[::-1].ravel()
+
+        if method == 'nearest':
+            valid_input, valid_output, index_array, _ = kd_tree.get_neighbour_info(
+                source_def, target_def, radius_of_influence, neighbours=1)
+            valid_source = np.flatnonzero(valid_input)
+
+            # index_array points to the valid old points, missing neighbours are flagged with their number
+            found = np.zeros(n_target, dtype=bool)
+            indices = np.zeros(n_target, dtype=int)
+            output_index = np.flatnonzero(valid_output)
+            has_neighbour = index_array < len(valid_source)
+            found[output_index[has_neighbour]] = True
+            indices[output_index[has_neighbour]] = valid_source[index_array[has_neighbour]]
+
+            plan.indices = np.empty(n_target, dtype=int)
+            plan.indices[area_to_grid] = indices
+            plan.outside = np.sort(area_to_grid[~found])
+        else:
+            with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+                warnings.simplefilter('ignore', FutureWarning)
+                t, s, valid_input, index_array = bilinear.get_bil_info(
+                    source_def, target_def, radius=radius_of_influence)
+            valid_source = np.flatnonzero(valid_input)
+
+            # bilinear weights of the four corners, as in pyresample
+            weights = np.column_stack([(1 - s) * (1 - t), s * (1 - t), (1 - s) * t, s * t])
+            inside = np.isfinite(weights).all(axis=1) & (index_array < len(valid_source)).all(axis=1)
+            rows = np.repeat(area_to_grid[inside], 4)
+            columns = valid_source[index_array[inside]].ravel()
+
+            plan.matrix = csr_matrix((weights[inside].ravel(), (rows, columns)), shape=(n_target, plan.n_source))
+            plan.outside = np.sort(area_to_grid[~inside])
+
+        return plan
+
+
+def regular_grid_area_definition(new_lat, new_lon):
+    """
+    Define a regular lat/lon grid as a pyresample area definition in EPSG:4326.
+
+    :param new_lat: 2D array of latitudes of the grid (meshgrid with indexing='ij', ascending).
+    :param new_lon: 2D array of longitudes of the grid (meshgrid with indexing='ij', ascending).
+    :return: pyresample AreaDefinition, with rows from north to south.
+    """
+    lats = np.asarray(new_lat)[:, 0]
+    lons = np.asarray(new_lon)[0, :]
+    lat_step = np.diff(lats).mean()
+    lon_step = np.diff(lons).mean()
+    if not (np.allclose(np.diff(lats), lat_step) and np.allclose(np.diff(lons), lon_step)):
+        raise ValueError('the new grid is not a regular lat/lon grid')
+
+    # the extent is given by the outer edges of the pixels
+    area_extent = (lons[0] - lon_step / 2, lats[0] - lat_step / 2,
+                   lons[-1] + lon_step / 2, lats[-1] + lat_step / 2)
+
+    return AreaDefinition('regular_grid', 'Regular lat/lon grid', 'regular_grid', 'EPSG:4326',
+                          len(lons), len(lats), area_extent)
+
+
+def grid_hash(*arrays, method=''):
+    """
+    Compute a hash identifying a set of grid coordinates and an interpolation method.
+
+    :param arrays: Coordinate arrays defining the grids.
+    :param method: Interpolation method.
+    :return: Hexadecimal hash string.
+    """
+    h = hashlib.sha1(method.encode())
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        h.update(str(arr.shape).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()[:16]
+
+
+# plans already used in this process, keyed by grid hash
+_regrid_plans = {}
+
+def get_regrid_plan(old_lat, old_lon, new_lat, new_lon, method='linear', cache_dir=None, backend='scipy'):
+    """
+    Return the RegridPlan for the given grids, building it only if it is not already
+    available in memory or in the cache directory.
+
+    :param old_lat: 2D array of latitudes for the old grid.
+    :param old_lon: 2D array of longitudes for the old grid.
+    :param new_lat: 2D array of latitudes for the new grid.
+    :param new_lon: 2D array of longitudes for the new grid.
+    :param method: Interpolation method ('linear', 'nearest').
+    :param cache_dir: If given, directory where plans are saved and looked up by grid hash.
+    :param backend: Library computing the weights ('scipy', or 'pyresample' for a regular new grid).
+    :return: RegridPlan object.
+    """
+    if backend not in ('scipy', 'pyresample'):
+        raise ValueError(f'unknown regridding backend {backend}, use scipy or pyresample')
 
-    return filled_data
+    # scipy plans keep the names used before the pyresample backend was added
+    plan_name = method if backend == 'scipy' else f'{backend}_{method}'
+    key = grid_hash(old_lat, old_lon, new_lat, new_lon, method=plan_name)
+    if key in _regrid_plans:
+        return _regrid_plans[key]
 
+    cache_path = os.path.join(cache_dir, f'regrid_plan_{plan_name}_{key}.npz') if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        plan = RegridPlan.load(cache_path)
+    else:
+        if backend == 'pyresample':
+            plan = RegridPlan.from_pyresample(old_lat, old_lon, new_lat, new_lon, method)
+        else:
+            plan = RegridPlan(old_lat, old_lon, new_lat, new_lon, method)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            plan.save(cache_path)
 
+    _regrid_plans[key] = plan
+    return plan
 
 
 """
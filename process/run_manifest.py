@@ -0,0 +1,180 @@
+"""
+Run manifest of the MSG preprocessing.
+For each processed timestamp a JSON-lines record is written with the status of the slot
+(ok, missing, corrupted), the type of the exception if it failed and the time spent in
+each processing stage (Scene open, load, crop, compute, fill, regrid, write).
+Running this module summarizes a manifest: throughput (slots/hour), p50/p95 stage latency
+and failure categories per month.
+
+Usage: python run_manifest.py log/manifest_satpy.jsonl
+
+@author: Daniele Corradini
+"""
+
+import os
+import json
+import time
+import socket
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+
+class SlotRecord:
+    """
+    Timing and status record of a single timestamp.
+    """
+
+    def __init__(self, t, timestamp):
+        """
+        :param t: Position of the timestamp in the list of timestamps of the period.
+        :param timestamp: Timestamp processed (datetime).
+        """
+        self.record = {
+            'slot': t,
+            'timestamp': timestamp.isoformat(),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'status': 'ok',
+            'started': time.time(),
+            'stages': {},
+        }
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager measuring the elapsed time (in seconds) of a processing stage.
+
+        :param name: Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record['stages'][name] = time.perf_counter() - start
+
+    def set_status(self, status, error=None):
+        """
+        Set the status of the slot, keeping the type and message of the exception if given.
+
+        :param status: Status of the slot ('ok', 'missing', 'corrupted').
+        :param error: Exception raised while processing the slot.
+        """
+        self.record['status'] = status
+        if error is not None:
+            self.record['error_type'] = type(error).__name__
+            self.record['error'] = str(error)
+
+
+def new_run_id():
+    """
+    Identifier of a run of the preprocessing, shared by all the records it writes (also by the
+    slots processed in worker processes), so that runs appended to the same manifest can be told apart.
+
+    :return: String with the host, the pid of the driver and the start time of the run.
+    """
+    return f'{socket.gethostname()}-{os.getpid()}-{int(time.time())}'
+
+
+def write_manifest_record(manifest_path, slot_record, run_id=None):
+    """
+    Append the record of a slot to the JSON-lines manifest.
+
+    :param manifest_path: Path to the manifest file.
+    :param slot_record: SlotRecord of the processed timestamp.
+    :param run_id: Identifier of the run, see new_run_id.
+    """
+    slot_record.record['finished'] = time.time()
+    if run_id is not None:
+        slot_record.record['run_id'] = run_id
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path, 'a') as f:
+        f.write(json.dumps(slot_record.record) + '\n')
+
+
+def read_manifest(manifest_path):
+    """
+    Read all the records of a JSON-lines manifest.
+
+    :param manifest_path: Path to the manifest file.
+    :return: List of record dictionaries.
+    """
+    with open(manifest_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_wall_time(records):
+    """
+    Wall clock time spent on a set of records: the time between the first start and the last end
+    of each run, summed over the runs, so the idle time between runs appended to the same manifest
+    is not counted. Records written without a run id are grouped by host and pid.
+
+    :param records: List of record dictionaries.
+    :return: Wall clock time (s).
+    """
+    by_run = defaultdict(list)
+    for record in records:
+        by_run[record.get('run_id') or f"{record['host']}-{record['pid']}"].append(record)
+
+    return sum(max(r['finished'] for r in run_records) - min(r['started'] for r in run_records)
+               for run_records in by_run.values())
+
+
+def summarize_manifest(records):
+    """
+    Summarize the records of a manifest by month of the processed timestamps.
+
+    :param records: List of record dictionaries.
+    :return: Dictionary keyed by month (YYYY-MM) with the number of slots, the throughput
+             in slots/hour, the p50/p95 latency of each stage and the count of each failure category.
+    """
+    by_month = defaultdict(list)
+    for record in records:
+        by_month[record['timestamp'][:7]].append(record)
+
+    summary = {}
+    for month, month_records in sorted(by_month.items()):
+        # wall clock time of the month, summed over the runs that processed it
+        wall_time = get_wall_time(month_records)
+        throughput = len(month_records) / wall_time * 3600 if wall_time > 0 else float('nan')
+
+        stage_times = defaultdict(list)
+        failures = defaultdict(int)
+        for record in month_records:
+            for stage, elapsed in record['stages'].items():
+                stage_times[stage].append(elapsed)
+            if record['status'] != 'ok':
+                failures[f"{record['status']}:{record.get('error_type', '-')}"] += 1
+
+        summary[month] = {
+            'slots': len(month_records),
+            'slots_per_hour': throughput,
+            'stages': {stage: {'p50': float(np.percentile(times, 50)), 'p95': float(np.percentile(times, 95))}
+                       for stage, times in stage_times.items()},
+            'failures': dict(failures),
+        }
+
+    return summary
+
+
+def print_summary(summary):
+    """
+    Print the summary returned by summarize_manifest.
+
+    :param summary: Dictionary returned by summarize_manifest.
+    """
+    for month, month_summary in summary.items():
+        print(f"{month}: {month_summary['slots']} slots, {month_summary['slots_per_hour']:.1f} slots/hour")
+        for stage, latency in month_summary['stages'].items():
+            print(f"    {stage:<10} p50 {latency['p50']:8.3f} s   p95 {latency['p95']:8.3f} s")
+        for category, count in sorted(month_summary['failures'].items()):
+            print(f"    failed {category}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the run manifest of the MSG preprocessing")
+    parser.add_argument('manifest_path', help="path to the JSON-lines manifest")
+    args = parser.parse_args()
+
+    print_summary(summarize_manifest(read_manifest(args.manifest_path)))
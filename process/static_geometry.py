@@ -0,0 +1,140 @@
+"""
+Static geometry of a regular lat/lon grid (e.g. the EXPATS grid), computed once
+per grid definition and stored as .npy files in a folder named by the grid hash.
+The fields are memory-mapped when loaded, so all the scripts using the same grid
+share the same arrays on disk and only read the pixels they use:
+
+- lat, lon: 2D coordinates of the grid, read by the preprocessing workers for each slot
+
+The store is identified by the grid hash, so a new grid gives a new store.
+The module also holds the orographic classification of the elevation and the index arithmetic
+on regular axes used by the orography analyses (see cmsaf/process_cma_functions.py).
+Run this module to build the store of the grid defined in config_satpy_process.py.
+
+@author: Daniele Corradini
+"""
+
+import os
+import shutil
+import numpy as np
+
+from regrid_functions import generate_regular_grid, grid_hash
+
+# elevation thresholds (m) of the orographic classes flat/hills/mountains
+flat_threshold = 200
+hill_threshold = 600
+
+static_fields = ['lat', 'lon']
+
+
+def regular_grid_indices(values, axis_values):
+    """
+    Index of the nearest point of a regular 1D axis for each value, by index arithmetic.
+
+    :param values: Array of coordinates.
+    :param axis_values: Regular (evenly spaced, ascending or descending) 1D axis.
+    :return: Array of indices in the axis, with the shape of values.
+    """
+    step = (axis_values[-1] - axis_values[0]) / (len(axis_values) - 1)
+    indices = np.rint((np.asarray(values) - axis_values[0]) / step)
+    return np.clip(indices, 0, len(axis_values) - 1).astype(int)
+
+
+def classify_elevation(elevation):
+    """
+    Orographic class of the elevation: 0 flat, 1 hills, 2 mountains.
+    """
+    return np.digitize(elevation, [flat_threshold, hill_threshold]).astype(np.int8)
+
+
+def build_static_geometry(lat_arr, lon_arr, store_path):
+    """
+    Compute the static fields of a regular grid and save them in the store folder.
+
+    :param lat_arr: 1D latitudes of the regular grid.
+    :param lon_arr: 1D longitudes of the regular grid.
+    :param store_path: Folder where the fields are saved.
+    """
+    lat, lon = np.meshgrid(lat_arr, lon_arr, indexing='ij')
+    fields = {'lat': lat, 'lon': lon}
+
+    # write to a temporary folder first, so concurrent readers never see a partial store
+    tmp_path = f'{store_path.rstrip("/")}.{os.getpid()}.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, field in fields.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), field)
+    try:
+        os.replace(tmp_path, store_path)
+    except OSError:
+        # the store was built by another process in the meantime
+        shutil.rmtree(tmp_path)
+
+
+class StaticGeometry:
+    """
+    Static fields of a regular grid, memory-mapped from the store folder.
+    """
+
+    def __init__(self, store_path):
+        """
+        :param store_path: Folder of the store, built with build_static_geometry.
+        """
+        self.store_path = store_path
+        self.fields = {name: np.load(os.path.join(store_path, f'{name}.npy'), mmap_mode='r')
+                       for name in static_fields}
+        self.lat_arr = np.asarray(self.fields['lat'][:, 0])
+        self.lon_arr = np.asarray(self.fields['lon'][0, :])
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def lookup(self, name, lat, lon):
+        """
+        Values of a field at the nearest grid points of the given coordinates, by index arithmetic.
+
+        :param name: Name of the field.
+        :param lat: Latitudes (1D, combined with lon as a grid, or same shape as lon).
+        :param lon: Longitudes (1D, combined with lat as a grid, or same shape as lat).
+        :return: Array of values, (lat, lon) if both are 1D, otherwise with their shape.
+        """
+        i = regular_grid_indices(lat, self.lat_arr)
+        j = regular_grid_indices(lon, self.lon_arr)
+        if np.ndim(lat) == 1 and np.ndim(lon) == 1:
+            return self.fields[name][np.ix_(i, j)]
+        return self.fields[name][i, j]
+
+
+def get_static_geometry(lat_arr, lon_arr, store_dir):
+    """
+    Return the static geometry of a regular grid, building the store only the first time.
+
+    :param lat_arr: 1D latitudes of the regular grid.
+    :param lon_arr: 1D longitudes of the regular grid.
+    :param store_dir: Directory of the stores, one folder per grid hash.
+    :return: StaticGeometry object.
+    """
+    key = grid_hash(lat_arr, lon_arr, method='static_geometry')
+    store_path = os.path.join(store_dir, f'static_geometry_{key}')
+    if not os.path.exists(store_path):
+        os.makedirs(store_dir, exist_ok=True)
+        build_static_geometry(lat_arr, lon_arr, store_path)
+    return StaticGeometry(store_path)
+
+
+def get_config_static_geometry():
+    """
+    Return the static geometry of the regular grid defined in config_satpy_process.py.
+
+    :return: StaticGeometry object.
+    """
+    from config_satpy_process import lonmin, lonmax, latmin, latmax, step_deg, static_geometry_dir
+
+    lat_arr, lon_arr = generate_regular_grid(latmin, latmax, lonmin, lonmax, step_deg)
+    return get_static_geometry(lat_arr, lon_arr, static_geometry_dir)
+
+
+if __name__ == "__main__":
+    geometry = get_config_static_geometry()
+    print(f'static geometry in {geometry.store_path}')
+    for name in static_fields:
+        print(f'    {name}: {geometry[name].shape} {geometry[name].dtype}')
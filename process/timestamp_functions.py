@@ -0,0 +1,106 @@
+"""
+This module provides an index to match timestamps to the position of the
+corresponding file in a list of files (MSG, CTH or other products).
+The index is built once from the list of timestamps (e.g. from extract_timestamps)
+and supports exact, nearest-within-tolerance and bracketing lookups in constant
+or logarithmic time, instead of scanning the whole list for each timestamp.
+
+@author: Daniele Corradini
+"""
+
+from datetime import timedelta
+import numpy as np
+
+
+def round_down_timestamp(timestamp, resolution):
+    """
+    Round down a timestamp to the start of its slot.
+
+    :param timestamp: datetime to round down.
+    :param resolution: Slot length in minutes.
+    :return: Rounded datetime.
+    """
+    return timestamp - timedelta(minutes=timestamp.minute % resolution,
+                                 seconds=timestamp.second,
+                                 microseconds=timestamp.microsecond)
+
+
+class TimestampIndex:
+    """
+    Index from slot time to the position of a timestamp in a list of timestamps.
+    If a slot appears more than once, the highest position is kept (as in find_highest_index).
+    """
+
+    def __init__(self, timestamps, resolution=None):
+        """
+        :param timestamps: List of datetime, e.g. extracted from the filenames of a product.
+        :param resolution: If given, slot length in minutes used to round down the timestamps.
+        """
+        self.resolution = resolution
+        self.positions = {}
+        for pos, timestamp in enumerate(timestamps):
+            self.positions[self._key(timestamp)] = pos
+
+        # sorted slot times for nearest and bracketing lookups
+        keys = sorted(self.positions)
+        self.sorted_times = np.array(keys, dtype='datetime64[s]')
+        self.sorted_positions = np.array([self.positions[key] for key in keys], dtype=int)
+
+    def _key(self, timestamp):
+        if self.resolution:
+            return round_down_timestamp(timestamp, self.resolution)
+        return timestamp
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, timestamp):
+        return self._key(timestamp) in self.positions
+
+    def find(self, timestamp):
+        """
+        Position of the timestamp, in constant time.
+
+        :param timestamp: datetime to look up.
+        :return: Position in the list of timestamps, or None if not found.
+        """
+        return self.positions.get(self._key(timestamp))
+
+    def find_nearest(self, timestamp, tolerance=timedelta(0)):
+        """
+        Position of the closest timestamp within the tolerance, in logarithmic time.
+
+        :param timestamp: datetime to look up.
+        :param tolerance: Maximum time difference (timedelta) from the timestamp.
+        :return: Position in the list of timestamps, or None if no timestamp is close enough.
+        """
+        pos = self.find(timestamp)
+        if pos is not None or len(self.sorted_times) == 0:
+            return pos
+
+        target = np.datetime64(timestamp, 's')
+        i = np.searchsorted(self.sorted_times, target)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(self.sorted_times)]
+        best = min(candidates, key=lambda j: abs(self.sorted_times[j] - target))
+        if abs(self.sorted_times[best] - target) <= np.timedelta64(tolerance):
+            return int(self.sorted_positions[best])
+        return None
+
+    def find_bracketing(self, timestamp, resolution):
+        """
+        Positions of the timestamps at the start and at the end of the slot of the given resolution
+        containing the timestamp, e.g. the CTH files (every 15 min) around an MSG timestamp (every 5 min).
+        If the timestamp is at the start of the slot, both positions are the same.
+
+        :param timestamp: datetime to look up.
+        :param resolution: Slot length in minutes of the indexed product.
+        :return: Tuple with the positions before and after, or None if one of them is not found.
+        """
+        t_before = round_down_timestamp(timestamp, resolution)
+        t_after = t_before if t_before == timestamp else t_before + timedelta(minutes=resolution)
+
+        pos_before = self.find(t_before)
+        pos_after = self.find(t_after)
+        if pos_before is None or pos_after is None:
+            return None
+        return (pos_before, pos_after)
@@ -0,0 +1,62 @@
+"""
+Open the daily netCDF files written by the preprocessing (DailyNetCDFWriter, compress_and_save)
+lazily with dask, using chunks aligned to the chunks stored in the file (e.g. one timestamp
+and 128x128 pixel tiles). Selecting one channel, one timestamp or a small crop then reads
+and decompresses only the tiles it touches instead of the whole day.
+
+Example:
+ds_day = open_daily_dataset(file, variables=['IR_108'])
+ds_crop = ds_day.isel(time=0, lat=slice(100, 200), lon=slice(50, 150)).load()
+
+@author: Daniele Corradini
+"""
+
+import netCDF4
+import xarray as xr
+
+
+def get_nc_chunks(path, variables=None):
+    """
+    Chunk sizes stored in a netCDF file for each dimension of the (chunked) variables.
+
+    :param path: Path to the netCDF file.
+    :param variables: List of variables to check, all the variables of the file if None.
+    :return: Dictionary with the chunk size of each dimension (the smallest among the variables).
+    """
+    chunks = {}
+    with netCDF4.Dataset(path) as nc:
+        for name in variables or nc.variables:
+            if name not in nc.variables:
+                continue
+            var = nc[name]
+            chunking = var.chunking()
+            if chunking == 'contiguous' or not var.dimensions:
+                continue
+            for dim, size in zip(var.dimensions, chunking):
+                chunks[dim] = min(chunks.get(dim, size), size)
+    return chunks
+
+
+def open_daily_dataset(path, variables=None, tiles_per_chunk=None, **kwargs):
+    """
+    Open a daily netCDF file with dask chunks aligned to the chunks stored in the file.
+
+    :param path: Path to the netCDF file.
+    :param variables: List of variables to open (the coordinates are always kept), all if None.
+    :param tiles_per_chunk: Dictionary with the number of stored chunks per dask chunk along
+                            each dimension, e.g. {'time': 4} to process 4 timestamps per task.
+                            A multiple of the stored chunks never splits a tile between two tasks.
+    :param kwargs: Other arguments passed to xarray.open_dataset.
+    :return: xarray.Dataset backed by dask arrays.
+    """
+    chunks = get_nc_chunks(path, variables)
+    for dim, factor in (tiles_per_chunk or {}).items():
+        if dim in chunks:
+            chunks[dim] *= factor
+
+    if variables is not None:
+        with netCDF4.Dataset(path) as nc:
+            kwargs.setdefault('drop_variables', [name for name in nc.variables
+                                                 if name not in variables and name not in nc.dimensions])
+
+    return xr.open_dataset(path, chunks=chunks, **kwargs)
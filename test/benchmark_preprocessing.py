@@ -0,0 +1,218 @@
+"""
+Benchmark of the preprocessing hot path on synthetic inputs, without any data on disk.
+A SEVIRI-like geostationary lat/lon grid and radiance fields are generated for
+domains of increasing size (the EXPATS domain scaled by a factor) and the time of:
+- regrid_data (griddata) and RegridPlan.apply
+- fill_missing_data_with_interpolation
+- crops_nc_random
+- apply_cma_mask (binary closing of the cloud mask)
+- DailyNetCDFWriter (daily NetCDF writing)
+is measured and saved as JSON, so that the results of two versions can be compared.
+
+Usage:
+python benchmark_preprocessing.py --sizes 0.5 1 --output results.json
+python benchmark_preprocessing.py --compare old_results.json
+
+@author: Daniele Corradini
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+import numpy as np
+import xarray as xr
+import scipy
+
+#methods of the preprocessing (relative to this folder, so the benchmark runs from any clone)
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_path, 'process'))
+sys.path.append(os.path.join(repo_path, 'data_generation'))
+from regrid_functions import generate_regular_grid, regrid_data, fill_missing_data_with_interpolation, RegridPlan
+from MSG_preprocess_satpy import DailyNetCDFWriter
+from cropping_functions import crops_nc_random, apply_cma_mask
+
+# EXPATS domain and SEVIRI grid
+lonmin, lonmax, latmin, latmax = 5, 16, 42, 51.5
+step_deg = 0.04
+sub_lon = 9.5
+pixel_size = 3000.403165817
+n_channels = 11
+
+
+def synthetic_seviri_grid(scale=1.):
+    """
+    Lat/lon of the SEVIRI pixels covering the EXPATS domain scaled by a factor around its center.
+    """
+    from pyproj import Proj
+    proj = Proj({'proj': 'geos', 'lon_0': sub_lon, 'h': 35785831., 'a': 6378169., 'b': 6356583.8, 'units': 'm'})
+
+    lon_c, lat_c = (lonmin + lonmax) / 2, (latmin + latmax) / 2
+    half_lon, half_lat = (lonmax - lonmin) / 2 * scale + 1, (latmax - latmin) / 2 * scale + 1
+    xs, ys = proj([lon_c - half_lon, lon_c + half_lon], [lat_c - half_lat, lat_c + half_lat])
+
+    x = np.arange(xs[0], xs[1], pixel_size)
+    y = np.arange(ys[1], ys[0], -pixel_size)
+    xv, yv = np.meshgrid(x, y)
+    lon, lat = proj(xv, yv, inverse=True)
+    return lat, lon
+
+
+def synthetic_regular_grid(scale=1.):
+    """
+    Regular lat/lon grid of the EXPATS domain scaled by a factor around its center.
+    """
+    lon_c, lat_c = (lonmin + lonmax) / 2, (latmin + latmax) / 2
+    half_lon, half_lat = (lonmax - lonmin) / 2 * scale, (latmax - latmin) / 2 * scale
+    return generate_regular_grid(lat_c - half_lat, lat_c + half_lat, lon_c - half_lon, lon_c + half_lon, step_deg)
+
+
+def synthetic_channels(lat, lon, missing_lines=3, seed=0):
+    """
+    Smooth brightness temperature-like fields (channel, y, x) with a few missing scan lines.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.stack([250 + 30 * np.sin(lat / (2 + c)) * np.cos(lon / (3 + c)) for c in range(n_channels)])
+    data += rng.normal(0, 0.5, data.shape)
+    data[:, rng.choice(lat.shape[0], missing_lines, replace=False), :] = np.nan
+    return data
+
+
+def timeit(func, repeat=3):
+    """
+    Elapsed times (s) of repeat calls of func.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(scale, repeat=3, n_slots=24, n_crops=20):
+    """
+    Run all the benchmarks for a domain size.
+
+    :param scale: Scale factor of the EXPATS domain.
+    :param repeat: Number of repetitions of each benchmark.
+    :param n_slots: Number of timestamps written in the daily NetCDF and masked with the CMA.
+    :param n_crops: Number of random crops.
+    :return: List of result dictionaries.
+    """
+    sat_lat, sat_lon = synthetic_seviri_grid(scale)
+    sat_data = synthetic_channels(sat_lat, sat_lon)
+    lat_arr, lon_arr = synthetic_regular_grid(scale)
+    lat_reg_grid, lon_reg_grid = np.meshgrid(lat_arr, lon_arr, indexing='ij')
+    filled = fill_missing_data_with_interpolation(sat_lat, sat_lon, sat_data)
+
+    # daily dataset on the regular grid
+    rng = np.random.default_rng(1)
+    times = [datetime(2023, 7, 1) + timedelta(minutes=15 * t) for t in range(n_slots)]
+    shape = (n_slots, len(lat_arr), len(lon_arr))
+    ds_day_var = xr.Dataset({'IR_108': (('time', 'lat', 'lon'), rng.uniform(200, 300, shape).astype(np.float32))},
+                            coords={'time': times, 'lat': lat_arr, 'lon': lon_arr})
+    ds_day = xr.Dataset({'cma': (('time', 'lat', 'lon'), (rng.random(shape) > 0.4).astype(np.int8))},
+                        coords={'time': times, 'lat': lat_arr, 'lon': lon_arr})
+
+    benchmarks = {}
+    for method in ['nearest', 'linear']:
+        benchmarks[f'regrid_data_{method}'] = lambda method=method: regrid_data(
+            sat_lat, sat_lon, filled, lat_reg_grid, lon_reg_grid, method)
+        plan = RegridPlan(sat_lat, sat_lon, lat_reg_grid, lon_reg_grid, method)
+        benchmarks[f'regrid_plan_apply_{method}'] = lambda plan=plan: plan.apply(filled)
+
+    for engine in ['griddata', 'grid']:
+        benchmarks[f'fill_missing_data_{engine}'] = lambda engine=engine: fill_missing_data_with_interpolation(
+            sat_lat, sat_lon, sat_data, engine=engine)
+    benchmarks['apply_cma_mask'] = lambda: apply_cma_mask(ds_day, ds_day_var.copy(deep=True), 300)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_type in ['nc', 'npy']:
+            benchmarks[f'crops_nc_random_{file_type}'] = lambda file_type=file_type: crops_nc_random(
+                ds_day_var.isel(time=[0]), 100, 100, n_crops, 'crop', tmp_dir, file_type)
+
+        def write_daily_file():
+            writer = DailyNetCDFWriter(tmp_dir + '/', 'daily.nc')
+            for t in range(n_slots):
+                writer.write(ds_day_var.isel(time=[t]))
+            writer.close()
+            os.remove(os.path.join(tmp_dir, 'daily.nc'))
+        benchmarks['daily_netcdf_write'] = write_daily_file
+
+        results = []
+        for name, func in benchmarks.items():
+            elapsed = timeit(func, repeat)
+            results.append({
+                'benchmark': name,
+                'scale': scale,
+                'source_shape': list(sat_lat.shape),
+                'target_shape': list(lat_reg_grid.shape),
+                'min': min(elapsed),
+                'median': float(np.median(elapsed)),
+            })
+            print(f"{name:<28} scale {scale:<4} min {min(elapsed):9.4f} s   median {np.median(elapsed):9.4f} s")
+
+    return results
+
+
+def get_metadata():
+    """
+    Version of the code and of the libraries used for the benchmark.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_path, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'date': datetime.now().isoformat(),
+        'commit': commit,
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'xarray': xr.__version__,
+    }
+
+
+def compare_results(results, reference):
+    """
+    Print the ratio between the median times of two runs for the benchmarks in both.
+    """
+    reference_times = {(r['benchmark'], r['scale']): r['median'] for r in reference['results']}
+    print(f"\ncompared with {reference['metadata'].get('commit')} ({reference['metadata'].get('date')})")
+    for r in results['results']:
+        key = (r['benchmark'], r['scale'])
+        if key in reference_times:
+            print(f"{r['benchmark']:<28} scale {r['scale']:<4} {r['median'] / reference_times[key]:6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the preprocessing on synthetic SEVIRI-like inputs")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.5, 1.0], help="scale factors of the EXPATS domain")
+    parser.add_argument('--repeat', type=int, default=3, help="repetitions of each benchmark")
+    parser.add_argument('--slots', type=int, default=24, help="timestamps of the daily file")
+    parser.add_argument('--output', default=None, help="path of the JSON results")
+    parser.add_argument('--compare', default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = {'metadata': get_metadata(), 'results': []}
+    for scale in args.sizes:
+        results['results'].extend(run_benchmarks(scale, args.repeat, args.slots))
+
+    output = args.output or f"benchmark_preprocessing_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nresults saved in {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
@@ -0,0 +1,83 @@
+"""
+Check of DailyNetCDFWriter with timestamps shaped as the ones returned by process_timestamp:
+the channels are assigned as (lat, lon) DataArrays (or (y, x) with the lat/lon grid in the native mode),
+without a 'time' dimension. Several timestamps with different values are written, also with the
+first one missing (NaN-filled, no lat/lon grid in the native mode), and the daily file is read back
+to check that each time step holds its own values.
+
+Usage:
+python check_daily_writer.py
+
+@author: Daniele Corradini
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+import xarray as xr
+
+#methods of the preprocessing (relative to this folder, so the check runs from any clone)
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_path, 'process'))
+from MSG_preprocess_satpy import DailyNetCDFWriter, create_dataset_with_lat_lon_dimensions
+
+channels = ['IR_108', 'WV_062']
+lat_arr = np.arange(45, 46, 0.25)
+lon_arr = np.arange(8, 9.5, 0.25)
+
+
+def slot_dataset(timestamp, value, regular_grid=True):
+    """
+    Dataset of a timestamp as built by process_timestamp, with all the channels set to value
+    (None for a missing timestamp, left NaN-filled).
+    """
+    ds = create_dataset_with_lat_lon_dimensions(channels, lat_arr, lon_arr, regular_grid)
+    ds['time'] = [timestamp]
+    if value is None:
+        return ds
+
+    for c, channel in enumerate(channels):
+        if regular_grid:
+            ds[channel] = xr.DataArray(np.full((len(lat_arr), len(lon_arr)), value + c, dtype=np.float32),
+                                       dims=("lat", "lon"),
+                                       coords={"lat": (["lat"], lat_arr.astype(np.float32)),
+                                               "lon": (["lon"], lon_arr.astype(np.float32))})
+        else:
+            ds["lon_grid"] = xr.DataArray(np.full((3, 4), 8.5 + value, dtype=np.float32), dims=("y", "x"))
+            ds["lat_grid"] = xr.DataArray(np.full((3, 4), 45.5 + value, dtype=np.float32), dims=("y", "x"))
+            ds[channel] = xr.DataArray(np.full((3, 4), value + c, dtype=np.float32), dims=("y", "x"))
+    return ds
+
+
+def check_writer(values, regular_grid, path):
+    """
+    Write one timestamp per value and check the values read back from the daily file.
+    """
+    timestamps = [datetime(2023, 7, 1) + timedelta(minutes=15 * t) for t in range(len(values))]
+    writer = DailyNetCDFWriter(path + '/', 'daily.nc')
+    for timestamp, value in zip(timestamps, values):
+        writer.write(slot_dataset(timestamp, value, regular_grid))
+    writer.close()
+
+    with xr.open_dataset(os.path.join(path, 'daily.nc')) as ds_day:
+        assert ds_day.sizes['time'] == len(values)
+        for t, value in enumerate(values):
+            for c, channel in enumerate(channels):
+                written = ds_day[channel].isel(time=t).values
+                if value is None:
+                    assert np.isnan(written).all(), f'{channel} of the missing timestamp {t} is not NaN'
+                else:
+                    assert np.all(written == value + c), f'{channel} at time {t}: {np.unique(written)} instead of {value + c}'
+            if not regular_grid and value is not None:
+                assert np.all(ds_day['lat_grid'].isel(time=t).values == 45.5 + value)
+    os.remove(os.path.join(path, 'daily.nc'))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for regular_grid in [True, False]:
+            for values in [[1, 2, 3], [None, 2, 3]]:
+                check_writer(values, regular_grid, tmp_dir)
+                print(f'regular_grid={regular_grid} values={values}: ok')
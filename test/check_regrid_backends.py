@@ -0,0 +1,101 @@
+"""
+Compare and benchmark the regridding backends of regrid_functions
+on a SEVIRI-like geostationary grid covering the EXPATS domain:
+griddata (regrid_data), the scipy RegridPlan and the pyresample RegridPlan.
+For each method it prints the time to build the plan, the time to regrid
+all the channels and the differences with the griddata results, and checks
+that the differences are within the tolerances of each backend:
+- scipy: same results as griddata
+- pyresample nearest: a different neighbour on at most 2% of the points, so the
+  differences are bounded by the difference between adjacent source pixels
+- pyresample linear (bilinear): differences below 0.05 (on fields of ~100 amplitude)
+
+@author: Daniele Corradini
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from pyproj import Proj
+from pyresample import AreaDefinition
+
+#methods for regridding (relative to this folder, so the check runs from any clone)
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_path, 'process'))
+from regrid_functions import generate_regular_grid, regrid_data, RegridPlan
+from config_satpy_process import lonmin, lonmax, latmin, latmax, step_deg, channels
+
+# tolerances of the differences with griddata: fraction of different points and maximum difference
+# (None: bounded by the largest difference between adjacent pixels of the source fields)
+tolerances = {('scipy', 'nearest'): (0., 1e-9),
+              ('scipy', 'linear'): (1., 1e-9),
+              ('pyresample', 'nearest'): (0.02, None),
+              ('pyresample', 'linear'): (1., 0.05)}
+
+# SEVIRI rapid scan position and pixel size at nadir (m)
+sub_lon = 9.5
+pixel_size = 3000.403165817
+
+def seviri_crop_grid(margin=1.):
+    """
+    Lat/lon of the SEVIRI pixels covering the domain (with a margin in degrees).
+    """
+    proj_dict = {'proj': 'geos', 'lon_0': sub_lon, 'h': 35785831., 'a': 6378169., 'b': 6356583.8, 'units': 'm'}
+    proj = Proj(proj_dict)
+    xs, ys = proj([lonmin - margin, lonmax + margin, lonmin - margin, lonmax + margin],
+                  [latmin - margin, latmin - margin, latmax + margin, latmax + margin])
+    extent = (min(xs), min(ys), max(xs), max(ys))
+    width = int((extent[2] - extent[0]) / pixel_size)
+    height = int((extent[3] - extent[1]) / pixel_size)
+    area = AreaDefinition('seviri_crop', 'SEVIRI crop', 'geos', proj_dict, width, height, extent)
+    lon, lat = area.get_lonlats()
+    return lat, lon
+
+
+def timeit(func, *args, repeat=3):
+    """
+    Best elapsed time over repeat calls, and the result of the last call.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    sat_lat, sat_lon = seviri_crop_grid()
+
+    # smooth synthetic fields, one per channel
+    data = np.stack([np.sin(sat_lat / (3 + c)) * np.cos(sat_lon / (2 + c)) * 100 + 200 for c in range(len(channels))])
+
+    lat_arr, lon_arr = generate_regular_grid(latmin, latmax, lonmin, lonmax, step_deg)
+    lat_reg_grid, lon_reg_grid = np.meshgrid(lat_arr, lon_arr, indexing='ij')
+
+    # largest difference between adjacent (also diagonal) source pixels
+    neighbour_step = np.abs(np.diff(data, axis=1)).max() + np.abs(np.diff(data, axis=2)).max()
+    print(f'SEVIRI crop {sat_lat.shape} -> regular grid {lat_reg_grid.shape}, {len(channels)} channels')
+
+    for method in ['nearest', 'linear']:
+        t_griddata, reference = timeit(regrid_data, sat_lat, sat_lon, data, lat_reg_grid, lon_reg_grid, method, repeat=1)
+        print(f'\n{method}: griddata {t_griddata:.3f} s')
+
+        builders = {'scipy': RegridPlan, 'pyresample': RegridPlan.from_pyresample}
+        for backend, build in builders.items():
+            t_build, plan = timeit(build, sat_lat, sat_lon, lat_reg_grid, lon_reg_grid, method, repeat=1)
+            t_apply, result = timeit(plan.apply, data)
+
+            valid = np.isfinite(reference) & np.isfinite(result)
+            diff = np.abs(result - reference)[valid]
+            nan_mismatch = np.sum(np.isfinite(reference) != np.isfinite(result))
+            print(f'    {backend:<10} build {t_build:.3f} s   apply {t_apply:.4f} s   '
+                  f'max diff {diff.max():.4f}   mean diff {diff.mean():.5f}   '
+                  f'identical {np.mean(diff == 0):.1%}   NaN mismatch {nan_mismatch}')
+
+            max_fraction, max_diff = tolerances[(backend, method)]
+            max_diff = neighbour_step if max_diff is None else max_diff
+            assert nan_mismatch == 0, f'{backend} {method}: {nan_mismatch} NaN mismatches'
+            assert np.mean(diff > 1e-9) <= max_fraction, f'{backend} {method}: {np.mean(diff > 1e-9):.1%} different points'
+            assert diff.max() <= max_diff, f'{backend} {method}: max diff {diff.max():.4f} > {max_diff:.4f}'